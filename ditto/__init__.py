@@ -90,6 +90,20 @@ doing something wrong, so this isn't exactly a heinous restriction. It just
 means there's no easy way to say "give me everything," because "everything" is
 never a good idea.
 
+Python only looks up "protocol" methods like ``__enter__`` and ``__exit__`` on
+an object's class. That's fine: ``Mock(Foo)`` is actually an instance of a
+subclass of ``Mock`` that's generated (once) for ``Foo``, so if your selector
+picks those methods, they end up on that subclass and ``with my_instance:``
+works as you'd hope, without affecting mocks of any other class::
+
+    def pick_functions(cls, method_name):
+        return method_name in ('__enter__', '__exit__', 'read')
+
+The default selector already picks ``__aenter__``, ``__aexit__``, ``__aiter__``
+and ``__anext__`` when the mocked class has them. Methods that are coroutine
+functions (``async def``) are mocked so that calling them returns something you
+can await; see ``ditto.aio``.
+
 Creating Expectations
 ---------------------
 
@@ -145,6 +159,39 @@ during your test, you can specify custom contexts by doing the following::
 Obviously you can operate on ``c1`` and ``c2`` just like you can on
 ``default_context``.
 
+Rather than passing ``_context`` to every mock, you can scope the context that
+mocks default to with ``use_context``::
+
+    with use_context() as c:
+        m = Mock(Foo)  # m is in c
+
+It works as a decorator too, giving each call a fresh context. Scopes are
+tracked with ``contextvars``, so tests running concurrently in threads or
+asyncio tasks don't see each other's expectations. ``current_context()``
+returns whichever context is in effect.
+
+``ditto.testing`` builds on this to give each test its own context and check
+it when the test is done, so you don't have to retire and assert by hand. With
+pytest, use the ``ditto_context`` fixture.
+
+Stubs that many tests share can live in a context of their own, declared once
+and then frozen. Contexts created with it as their parent fall back on its
+stubs for any call their own expectations don't match::
+
+    stubs = Context()
+    config = Mock(Config, _context=stubs)
+    config.get.expect('debug').returns(False).infinite_times()
+    stubs.freeze()
+
+    with use_context(Context(parent=stubs)) as c:
+        config.get.expect('debug').returns(True)  # goes into c
+        ...
+        c.assert_no_more_expectations()  # only checks c
+
+Expectations that tests use up can be reset rather than redeclared: take a
+``snapshot()`` of the context once they're declared, and ``restore()`` it after
+each test. Restoring only undoes what changed since the snapshot.
+
 Expecting Indefinite Arguments
 ------------------------------
 
@@ -173,6 +220,13 @@ this module::
 
 You can also wrap *any* instance that declares the method
 ``matches(other_thing)`` with ``matches()``, not just those found in hamcrest.
+In particular, ``ditto.matchers`` has fast versions of a few common ones
+(``anything``, ``instance_of``, ``equal_to``, ``contains_string`` and
+``predicate``), so you don't need hamcrest installed for simple cases::
+
+    from ditto.matchers import instance_of
+
+    my_instance.foo.expect(matches(instance_of(str)))
 
 Changing Expectations
 ---------------------
@@ -240,6 +294,11 @@ to get to the very end to realize that there's no way the test can pass. This
 is useful because it helps make the traceback from the actual problematic call
 site visible.
 
+A very long sequence, like a recorded session being replayed, doesn't have to
+be declared up front. A ``StreamingSequence`` reads its expectations from an
+iterator (say, a generator) as the calls come in, keeping only a few of them
+around at a time.
+
 Applicative Declaration
 -----------------------
 
@@ -290,18 +349,50 @@ So what does all of this mean? It's entirely possible that every single mock
 instance you'll ever create can be created with a *single python expression*,
 and without having to declare a class. Beat that, googlemock. ;)
 
+When a big table needs many mocks that all expect the same things, declare
+those expectations once on a ``Prototype`` and clone it instead::
+
+    segment = Prototype(PdtsSeg)
+    segment.mock.send.expect().times(5)
+    segment.mock.send_new_data.expect(matches(anything())).times(3)
+
+    my_data = [{'id': n, 'segment': segment.clone()} for n in range(1000)]
+
+Likewise, a big table of calls to a single method is quicker to declare in one
+go with ``expect_many()``, which takes rows of ``(args, kwargs, returns,
+times)``::
+
+    m.lookup.expect_many(((key,), None, value)
+                         for key, value in table.items())
+
 To Do
 =====
 
 There's still a bunch to do.
 
-    - Currently, you have to manually retire expectations and check that all
-      expectations were met. Surely there's a better way.
     - Should there be an easy way to make expectations from the same mocked
       instance go into different contexts?
 """
 
 import collections
+import itertools
+import operator
+import sys
+import time
+
+try:
+    from collections.abc import Iterable
+except ImportError:
+    from collections import Iterable
+
+# The low-level thread module is built in, so unlike threading (or
+# contextlib, functools, contextvars, reprlib and weakref, which are only
+# imported
+# where they're used) it costs nothing to import.
+try:
+    import _thread
+except ImportError:
+    import thread as _thread
 
 def str_tuple(tupl):
     return tuple(map(str, tupl))
@@ -321,23 +412,213 @@ def method_to_str(cls, method, args, kwargs):
     )
 
 
+_literal_types = set([type(None), bool, int, float, complex, str, bytes,
+                      type(u'')])
+try:
+    _literal_types.add(long)
+except NameError:
+    pass
+
+
+def is_literal(value):
+    """True if `value` is a builtin immutable whose hash is consistent with
+    its ``==``, so that looking it up in a dict gives the same answer as
+    comparing it.
+    """
+    if type(value) in _literal_types:
+        return True
+    if type(value) is tuple:
+        for item in value:
+            if not is_literal(item):
+                return False
+        return True
+    return False
+
+
+def exact_key(args, kwargs):
+    """Return a hashable key for a call with `args` and `kwargs`, or None if
+    they contain anything that isn't a literal (``matches`` wrappers
+    included).
+    """
+    if type(args) is not tuple or type(kwargs) is not dict:
+        return None
+
+    for value in args:
+        if type(value) not in _literal_types and not is_literal(value):
+            return None
+
+    # The args tuple alone is a fine key, because it can't ever be mistaken
+    # for the (args, kwargs) one: frozensets aren't literals.
+    if not kwargs:
+        return args
+
+    for value in kwargs.values():
+        if type(value) not in _literal_types and not is_literal(value):
+            return None
+
+    return (args, frozenset(kwargs.items()))
+
+
+# Stands for an ``exact_key`` that hasn't been worked out yet.
+_unknown_key = object()
+
+
+_LITERAL, _OTHER, _MATCHER = range(3)
+
+
+def _argument_kind(value):
+    if isinstance(value, matches):
+        return _MATCHER
+    if is_literal(value):
+        return _LITERAL
+    return _OTHER
+
+
+# Generated matcher factories, by shape. See ``compile_matcher``.
+_matcher_factories = {}
+
+_missing = object()
+
+
+def compile_matcher(expected_args, expected_kwargs):
+    """Return a function(args, kwargs) that's true exactly when
+    ``expected_args == args and expected_kwargs == kwargs`` is, but that turns
+    a call down as cheaply as it can, or None if that expression is already
+    the cheapest way. It checks the number of arguments and the keyword names
+    first, then literal values, then other values, and ``matches`` wrappers
+    last, so that a call which can't match is usually rejected before any
+    matcher runs.
+
+    Plain equality, keywords first, already checks things in that order when
+    no argument is more expensive than the ones after it and the keywords are
+    all literals: tuple equality looks at the lengths before the values. It
+    runs in C, so there's nothing to compile then, and ``Expectation`` just
+    uses ``expected_kwargs == kwargs and expected_args == args``. Otherwise,
+    code is generated once per shape of expectation (which argument positions
+    and how many keywords, checked in what order) and then just instantiated
+    with each expectation's values.
+    """
+    steps = []
+    if type(expected_args) is tuple:
+        arity = len(expected_args)
+        for position, value in enumerate(expected_args):
+            steps.append((_argument_kind(value), 'a', position, value))
+    else:
+        arity = None
+        steps.append((_argument_kind(expected_args), 'A', None,
+                      expected_args))
+
+    if type(expected_kwargs) is dict:
+        keywords = len(expected_kwargs)
+        for key, value in expected_kwargs.items():
+            steps.append((_argument_kind(value), 'k', key, value))
+    else:
+        keywords = None
+        steps.append((_argument_kind(expected_kwargs), 'K', None,
+                      expected_kwargs))
+
+    kinds = [step[0] for step in steps]
+    in_order = kinds == sorted(kinds) and not any(
+        kind != _LITERAL for kind, where, position, value in steps
+        if where in 'kK'
+    )
+
+    if in_order or len(steps) > 100:
+        # Beyond 100 steps there are too many parameters for a generated
+        # function, and it wouldn't be fast anyway.
+        return None
+
+    # Stable, so that equally cheap checks stay in argument order.
+    steps.sort(key=operator.itemgetter(0))
+
+    shape = (arity, keywords,
+             tuple((where, position if where == 'a' else None)
+                   for kind, where, position, value in steps))
+    factory = _matcher_factories.get(shape)
+    if factory is None:
+        factory = _matcher_factories[shape] = _generate_matcher(shape)
+
+    values = []
+    for kind, where, position, value in steps:
+        if where == 'k':
+            values.append(position)
+        values.append(value)
+
+    return factory(*values)
+
+
+def _generate_matcher(shape):
+    arity, keywords, steps = shape
+
+    params = []
+    lines = []
+
+    guards = []
+    if arity is not None:
+        guards.append('len(args) != %d' % arity)
+    if keywords is not None:
+        guards.append('len(kwargs) != %d' % keywords)
+    keys = ['k%d' % n for n, (where, position) in enumerate(steps)
+            if where == 'k']
+    guards.extend('%s not in kwargs' % key for key in keys)
+    if guards:
+        lines.append('if %s: return False' % ' or '.join(guards))
+
+    # As in ``Expectation._matches``, the expected value has to be on the
+    # left of ==, so this is `e == x` and never `x == e`. The `is` test is
+    # what tuple and dict equality do first, too.
+    for n, (where, position) in enumerate(steps):
+        expected = 'e%d' % n
+        if where == 'a':
+            lines.append('x = args[%d]' % position)
+            lines.append('if x is not %s and not %s == x: return False' % (
+                expected, expected))
+        elif where == 'k':
+            params.append('k%d' % n)
+            lines.append('x = kwargs[k%d]' % n)
+            lines.append('if x is not %s and not %s == x: return False' % (
+                expected, expected))
+        else:
+            actual = 'args' if where == 'A' else 'kwargs'
+            lines.append('if not %s == %s: return False' % (expected, actual))
+        params.append(expected)
+    lines.append('return True')
+
+    source = 'def factory(%s):\n    def match(args, kwargs):\n%s\n' \
+             '    return match\n' % (
+                 ', '.join(params),
+                 '\n'.join('        ' + line for line in lines),
+             )
+    namespace = {}
+    exec(source, namespace)
+
+    return namespace['factory']
+
+
 class MockError(AssertionError):
 
     cls_mock_msg = 'Mock:         {module}.{cls} at 0x{id:x}'
     mod_mock_msg = 'Mock:         {module} at 0x{id:x}'
     expt_msg = 'Expectation:  {method}({args})'
+    more_msg = '... and {count} more expectations'
+
+    # If not None, the most expectations an expectation set will list.
+    max_expectations = None
 
     def format_expectation(self, exp):
       return self.expt_msg.format(
           method=exp.method.name,
-          args=', '.join(
-            ([repr(a) for a in exp.args]
-                if isinstance(exp.args, collections.Iterable)
-                    else ['*' + repr(exp.args)]) +
-            (['{k}={v!r}'.format(k=k, v=v) for k, v in exp.kwargs.items()]
-                if hasattr(exp.kwargs, 'items')
-                    else ['**' + repr(exp.kwargs)])
-          ),
+          args=self.format_arguments(exp),
+      )
+
+    def format_arguments(self, exp):
+      return ', '.join(
+        ([repr(a) for a in exp.args]
+            if isinstance(exp.args, Iterable)
+                else ['*' + repr(exp.args)]) +
+        (['{k}={v!r}'.format(k=k, v=v) for k, v in exp.kwargs.items()]
+            if hasattr(exp.kwargs, 'items')
+                else ['**' + repr(exp.kwargs)])
       )
 
     def format_mock(self, mock, expectation_list):
@@ -366,17 +647,70 @@ class MockError(AssertionError):
 
 
     def format_expectation_set(self, expectations):
+        # In the order they were declared, since the snapshots come from
+        # unordered collections. That keeps messages the same from run to run
+        # and, when they're cut short, lists the earliest declarations.
+        expectations = sorted(expectations, key=_declaration_order)
+
+        omitted = 0
+        if self.max_expectations is not None and \
+                len(expectations) > self.max_expectations:
+            omitted = len(expectations) - self.max_expectations
+            expectations = expectations[:self.max_expectations]
+
         mocks = collections.defaultdict(lambda: [])
         for e in expectations:
             mocks[e.method.mock].append(e)
 
-        return '\n\n'.join([
+        formatted = [
             self.format_mock(m, exp_list)
             for m, exp_list in mocks.items()
-        ])
+        ]
+        if omitted:
+            formatted.append(self.more_msg.format(count=omitted))
+
+        return '\n\n'.join(formatted)
+
+
+def _declaration_order(expectation):
+    # Expectations that were never added to a context have no serial.
+    serial = expectation._serial
+    return -1 if serial is None else serial
+
+
+# UnmetExpectations and UnexpectedMethodCall can describe a whole context's
+# worth of expectations, and some tests raise and catch them on purpose. So
+# they only take a snapshot of the expectations when raised, and format their
+# message the first time somebody asks for it.
 
+class _DeferredMessage(MockError):
+
+    """A ``MockError`` whose message is only put together when it's needed,
+    by ``__str__``. `args`, ``repr()`` and pickling ask for it, too. What
+    gets pickled is only the message, not the expectations it describes.
+    """
+
+    _message = None
+
+    @property
+    def args(self):
+        return (str(self),)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, str(self))
+
+    def __reduce__(self):
+        return _unpickle_deferred_message, (type(self), str(self))
+
+
+def _unpickle_deferred_message(cls, message):
+    error = cls.__new__(cls)
+    error._message = message
+    return error
+
+
+class UnmetExpectations(_DeferredMessage):
 
-class UnmetExpectations(MockError):
     msg = """
 
 Required Expectations:
@@ -384,13 +718,21 @@ Required Expectations:
     """
 
     def __init__(self, context):
-        super(UnmetExpectations, self).__init__(
-            self.msg.format(
-                required=self.format_expectation_set(context.required_expectations())
+        super(UnmetExpectations, self).__init__()
+        self.required = [
+            x for x in context._active_unordered() if not x._is_optional
+        ]
+        self._message = None
+
+    def __str__(self):
+        if self._message is None:
+            self._message = self.msg.format(
+                required=self.format_expectation_set(self.required)
             )
-        )
 
-class UnexpectedMethodCall(MockError):
+        return self._message
+
+class UnexpectedMethodCall(_DeferredMessage):
 
     msg = """
 
@@ -401,13 +743,39 @@ Active Expectation Set:
 {active}
     """
 
+    recent_msg = """
+Recent Calls:
+{recent}
+    """
+
+    # How many of the most recent calls to list, if the context keeps a
+    # journal.
+    max_recent_calls = 10
+
     def __init__(self, test_expectation):
-        super(UnexpectedMethodCall, self).__init__(
-            self.msg.format(
-                unmet=self.format_mock(test_expectation.method.mock, [test_expectation]),
-                active=self.format_expectation_set(test_expectation.context.active_expectations()),
+        super(UnexpectedMethodCall, self).__init__()
+        self.call = test_expectation
+        self.active = test_expectation.context._active_unordered()
+
+        self.journal = test_expectation.context.journal
+        self.recent = []
+        if self.journal is not None:
+            self.recent = self.journal.recent(self.max_recent_calls)
+
+        self._message = None
+
+    def __str__(self):
+        if self._message is None:
+            self._message = self.msg.format(
+                unmet=self.format_mock(self.call.method.mock, [self.call]),
+                active=self.format_expectation_set(self.active),
             )
-        )
+            if self.recent:
+                self._message += self.recent_msg.format(recent='\n'.join(
+                    self.journal.format_entry(x) for x in self.recent
+                ))
+
+        return self._message
 
 
 class UnequalSumArguments(MockError):
@@ -421,30 +789,1114 @@ class Context(object):
     have different sets of mock verifications going on at the same time. If you
     just want one, then just don't specify one, and you'll automatically use
     the singleton declared in this library.
+
+    A ``Context`` isn't thread-safe. If the code under test calls mocks from
+    several threads, use a ``ThreadSafeContext``.
     
+    Expectations and sequences are tracked by identity, never by ``==``, so
+    bookkeeping can't invoke user matchers or mix up two expectations that
+    merely look the same.
+
+    A context can have a `parent`, which must be frozen (see ``freeze()``).
+    Calls that match none of the context's own expectations fall back on the
+    parent's, so a library of stubs can be declared once and shared by many
+    contexts. ``assert_no_more_expectations()`` only checks the context's own
+    expectations.
+
+    ``snapshot()`` and ``restore()`` roll a context back to an earlier state,
+    so an expensive set of expectations can be declared once and reused.
+
     :Attributes:
-        - `expectations`: The list of all current (non-retired) expectations.
-        - `sequences`: The list of all sequences that could still potentially
-          happen.
+        - `expectations`: A tuple of all current (non-retired) expectations
+          that aren't in a sequence, in declaration order. It's worked out
+          afresh on every access, from the dispatch indexes. It used to be a
+          plain list that could be changed in place, which no longer has any
+          effect, so it's a tuple: add and retire expectations through mocks
+          and ``retire_all_expectations()`` instead.
+        - `sequences`: A tuple of all sequences that could still potentially
+          happen, which is read-only in the same way.
+        - `stats`: The ``DispatchStats`` being collected, if
+          ``enable_stats()`` was called.
+        - `journal`: The ``CallJournal`` of recent calls, if
+          ``enable_journal()`` was called.
+        - `parent`: The frozen context to fall back on, or None.
+        - `frozen`: Whether ``freeze()`` was called.
     """
 
-    def __init__(self):
-        self.expectations = []
-        self.sequences = []
+    def __init__(self, parent=None):
+        if parent is not None and not parent.frozen:
+            raise MockError("A context's parent must be frozen")
+
+        self.parent = parent
+        self.frozen = False
+        self._sequences = collections.OrderedDict()
+
+        # Dispatch indexes. `_index` maps each mocked method to a
+        # ``_MethodIndex`` of its free expectations, and `_heads` maps each
+        # mocked method to the sequences whose head expectation is on that
+        # method, in the same order as `sequences`. A call only ever looks at
+        # its own method's entries.
+        self._index = {}
+        self._heads = {}
+        self._serial = itertools.count()
+
+        self.stats = None
+        self.journal = None
+
+        # While there are snapshots, `_undo` logs how to reverse every change
+        # since the oldest of them, most recent last.
+        self._snapshots = []
+        self._undo = None
+
+    @property
+    def expectations(self):
+        expectations = self._free_unordered()
+        expectations.sort(key=operator.attrgetter('_serial'))
+
+        return tuple(expectations)
+
+    @property
+    def sequences(self):
+        return tuple(self._sequences)
 
     def active_expectations(self):
-        return [x.expectations[0] for x in self.sequences] + self.expectations
+        return [x.expectations[0] for x in self._sequences] + \
+               list(self.expectations)
 
     def required_expectations(self):
         return [x for x in self.active_expectations() if not x._is_optional]
 
     def retire_all_expectations(self):
-        self.expectations = []
-        self.sequences = []
+        if self.frozen:
+            raise MockError("Can't retire the expectations of a frozen "
+                            "context")
+
+        if self._undo is not None:
+            self._undo.append((self._undo_reset, self._sequences, self._index,
+                               self._heads,
+                               [(x, list(x.expectations))
+                                for x in self._sequences]))
+
+        for seq in self._sequences:
+            seq.expectations.clear()
+
+        self._sequences = collections.OrderedDict()
+        self._index = {}
+        self._heads = {}
 
     def assert_no_more_expectations(self):
-        if self.required_expectations():
-            raise UnmetExpectations(self)
+        for expectation in self._active_unordered():
+            if not expectation._is_optional:
+                raise UnmetExpectations(self)
+
+    def freeze(self):
+        """Make this context read-only so that it can be the parent of other
+        contexts, and return it.
+
+        Only expectations that never change when they're met can be frozen:
+        ones with ``infinite_times()``, outside any sequence and without
+        ``until_sums_to()``. Since nothing changes, a frozen context can be
+        shared between threads, too.
+
+        Once it's frozen, its mocks send their calls and new expectations to
+        the current context (see ``current_context()``) whenever that's one of
+        its descendants, and only answer calls themselves otherwise.
+        """
+        if self.frozen:
+            return self
+
+        if self._sequences:
+            raise MockError("Can't freeze a context with sequences")
+
+        for expectation in self._free_unordered():
+            if expectation._num_times is not Expectation.infinite or \
+                    expectation._sum_barrier is not True:
+                raise MockError('Only expectations of infinite_times() can '
+                                'be frozen: %s' % expectation)
+            if expectation._matcher is None:
+                expectation._compile()
+
+        self.frozen = True
+        self._instrument()
+
+        return self
+
+    def snapshot(self):
+        """Return a ``Snapshot`` of this context's expectations and sequences,
+        which ``restore()`` can later roll the context back to.
+
+        Taking a snapshot copies nothing. Instead, from then on the context
+        saves whatever a call or a new declaration is about to change, so
+        restoring costs as much as the changes since the snapshot rather than
+        the whole context. This covers calls (remaining ``times()``,
+        ``until_sums_to()`` progress and retirement), new expectations and
+        sequences, and ``retire_all_expectations()``; it doesn't cover
+        reconfiguring expectations that existed when the snapshot was taken.
+        """
+        snapshot = Snapshot(self, len(self._undo or ()))
+        self._snapshots.append(snapshot)
+
+        if self._undo is None:
+            self._undo = []
+            self._instrument()
+
+        return snapshot
+
+    def restore(self, snapshot):
+        """Roll this context back to the state it was in when `snapshot` was
+        taken. The snapshot stays usable, but any taken after it don't.
+        """
+        for position, taken in enumerate(self._snapshots):
+            if taken is snapshot:
+                break
+        else:
+            raise MockError('Snapshot is from another context, or from after '
+                            'a snapshot that was restored')
+        del self._snapshots[position + 1:]
+
+        undo = self._undo
+        reordered = False
+        while len(undo) > snapshot.mark:
+            entry = undo.pop()
+            reordered = entry[0](*entry[1:]) or reordered
+
+        if reordered:
+            self._sequences = collections.OrderedDict(
+                (x, None) for x in sorted(self._sequences,
+                                          key=operator.attrgetter('_serial'))
+            )
+
+    def enable_stats(self):
+        """Start collecting ``DispatchStats`` for the calls made through this
+        context, and return them.
+
+        Until then, collecting costs nothing: the instrumented call path is
+        only swapped in while stats or the journal are on.
+        """
+        if self.stats is None:
+            self.stats = DispatchStats()
+            _instrument_matching(1)
+            self._instrument()
+
+        return self.stats
+
+    def disable_stats(self):
+        """Stop collecting stats, and return the ones collected."""
+        stats = self.stats
+        if stats is not None:
+            self.stats = None
+            _instrument_matching(-1)
+            self._instrument()
+
+        return stats
+
+    def enable_journal(self, capacity=1000, capture='repr'):
+        """Start recording the calls made through this context in a
+        ``CallJournal`` that holds the last `capacity` of them, and return it.
+        `capture` says how each call's arguments are kept: see
+        ``CallJournal``.
+
+        While the journal is on, ``UnexpectedMethodCall`` messages list the
+        most recent calls.
+        """
+        if self.journal is None:
+            self.journal = CallJournal(capacity, capture)
+            self._instrument()
+
+        return self.journal
+
+    def disable_journal(self):
+        """Stop recording calls, and return the journal."""
+        journal = self.journal
+        if journal is not None:
+            self.journal = None
+            self._instrument()
+
+        return journal
+
+    def _instrument(self):
+        """Route calls through the instrumented call path if stats or the
+        journal are on, and through the plain one otherwise.
+        """
+        if self.stats is not None or self.journal is not None:
+            self._dispatch = self._dispatch_instrumented
+            self._find = self._find_instrumented
+        elif self._undo is not None:
+            self.__dict__.pop('_dispatch', None)
+            self._find = self._find_logged
+        else:
+            self.__dict__.pop('_dispatch', None)
+            self.__dict__.pop('_find', None)
+
+        if self.frozen:
+            self._dispatch = self._dispatch_frozen
+
+    def _dispatch_frozen(self, method, args, kwargs):
+        context = self._routed_context()
+        if context is not self:
+            return context._dispatch(method, args, kwargs)
+
+        if self.stats is not None or self.journal is not None:
+            return self._dispatch_instrumented(method, args, kwargs)
+        return type(self)._dispatch(self, method, args, kwargs)
+
+    def _routed_context(self):
+        """Return the context that the mocks of this frozen context should
+        use right now: the current context if it descends from this one, and
+        this one otherwise.
+        """
+        context = current_context()
+        ancestor = context.parent
+        while ancestor is not None:
+            if ancestor is self:
+                return context
+            ancestor = ancestor.parent
+
+        return self
+
+    def _dispatch_instrumented(self, method, args, kwargs):
+        stats = self.stats
+        journal = self.journal
+
+        call = _CallRecord()
+        outer = _recording.call
+        _recording.call = call
+        start = _timer()
+        try:
+            return type(self)._dispatch(self, method, args, kwargs)
+        finally:
+            elapsed = _timer() - start
+            _recording.call = outer
+            if stats is not None:
+                stats._add(method, call, elapsed)
+            if journal is not None:
+                journal._add(method, args, kwargs, call.found)
+
+    def _find_instrumented(self, method, args, kwargs):
+        call = _recording.call
+        start = _timer()
+        found = type(self)._find(self, method, args, kwargs)
+        call.match_time += _timer() - start
+        call.found = found
+
+        if found is not None and self._undo is not None:
+            self._log_call(found)
+
+        return found
+
+    def _find_logged(self, method, args, kwargs):
+        found = type(self)._find(self, method, args, kwargs)
+        if found is not None:
+            self._log_call(found)
+
+        return found
+
+    def _log_call(self, expectation):
+        """Save what calling `expectation`, which is about to happen, could
+        change.
+        """
+        sum_barrier = expectation._sum_barrier
+        if expectation.context is not self or (
+                expectation._num_times is Expectation.infinite and
+                sum_barrier is True):
+            return
+
+        actual = None
+        if sum_barrier is not True and sum_barrier.actual is not None:
+            actual_args, actual_kwargs = sum_barrier.actual
+            actual = (list(actual_args), dict(actual_kwargs))
+
+        # The expectations that retiring would pop off the front of each
+        # sequence that `expectation` heads.
+        popped = []
+        if expectation._num_times == 1:
+            for seq in expectation._sequences:
+                expectations = seq.expectations
+                if expectations and expectations[0] is expectation:
+                    count = 1
+                    while count < len(expectations) and \
+                            expectations[count]._retired:
+                        count += 1
+                    popped.append(
+                        (seq, [expectations[x] for x in range(count)])
+                    )
+
+        self._undo.append((self._undo_call, expectation,
+                           expectation._num_times, expectation._retired,
+                           actual, expectation._chain, expectation._prev,
+                           expectation._next, popped))
+
+    def _undo_call(self, expectation, num_times, retired, actual, chain,
+                   prev, next, popped):
+        expectation._num_times = num_times
+        expectation._retired = retired
+        if expectation._sum_barrier is not True:
+            expectation._sum_barrier.actual = actual
+
+        if chain is not None and expectation._chain is None:
+            self._index[expectation.method].relink(expectation, chain, prev,
+                                                   next)
+
+        reordered = False
+        for seq, front in popped:
+            expectations = seq.expectations
+            if expectations and expectations[0] is front[0]:
+                continue
+
+            if expectations:
+                self._drop_head(seq, expectations[0].method)
+            else:
+                self._sequences[seq] = None
+                reordered = True
+            expectations.extendleft(reversed(front))
+            self._insert_head(seq)
+
+        return reordered
+
+    def _undo_add(self, *expectations):
+        for expectation in expectations:
+            if expectation._chain is not None:
+                self._remove_expectation(expectation)
+
+    def _undo_sequence(self, seq, expectation, chain, prev, next, in_sequence,
+                       serial):
+        seq.expectations.pop()
+        expectation._sequences = expectation._sequences[:-1]
+        expectation._is_in_sequence = in_sequence
+
+        if serial is not False:
+            # `seq` was empty, so `expectation` was its head.
+            self._drop_head(seq, expectation.method)
+            del self._sequences[seq]
+            seq._serial = serial
+
+        if chain is not None:
+            self._index[expectation.method].relink(expectation, chain, prev,
+                                                   next)
+
+    def _undo_reset(self, sequences, index, heads, contents):
+        self._sequences = sequences
+        self._index = index
+        self._heads = heads
+        for seq, expectations in contents:
+            seq.expectations.extend(expectations)
+
+    def _free_unordered(self):
+        free = []
+        for index in self._index.values():
+            free.extend(index)
+
+        return free
+
+    def _active_unordered(self):
+        """``active_expectations()``, in no particular order, which is cheap
+        enough to snapshot whenever a mock error gets raised.
+        """
+        return [x.expectations[0] for x in self._sequences] + \
+               self._free_unordered()
+
+    def _add_expectation(self, expectation, key=_unknown_key):
+        if self.frozen:
+            raise MockError("Can't add expectations to a frozen context")
+
+        expectation._serial = next(self._serial)
+
+        index = self._index.get(expectation.method)
+        if index is None:
+            index = self._index[expectation.method] = _MethodIndex()
+        index.add(expectation, key)
+
+        if self._undo is not None:
+            self._undo.append((self._undo_add, expectation))
+
+    def _add_expectations(self, method, expectations):
+        """``_add_expectation()`` for a batch of expectations of `method`."""
+        if self.frozen:
+            raise MockError("Can't add expectations to a frozen context")
+
+        index = self._index.get(method)
+        if index is None:
+            index = self._index[method] = _MethodIndex()
+        index.extend(expectations, self._serial)
+
+        if self._undo is not None:
+            self._undo.append((self._undo_add,) + tuple(expectations))
+
+    def _remove_expectation(self, expectation):
+        index = self._index.get(expectation.method)
+        if index is not None:
+            index.remove(expectation)
+
+    def _add_to_sequence(self, seq, expectation):
+        if self._undo is not None:
+            # A False serial means `seq` was already in this context.
+            self._undo.append((self._undo_sequence, seq, expectation,
+                               expectation._chain, expectation._prev,
+                               expectation._next, expectation._is_in_sequence,
+                               False if seq in self._sequences else
+                               getattr(seq, '_serial', None)))
+
+        seq.expectations.append(expectation)
+        expectation._sequences += (seq,)
+
+        if expectation._chain is not None:
+            self._remove_expectation(expectation)
+        if seq not in self._sequences:
+            self._add_sequence(seq)
+
+    def _add_sequence(self, seq):
+        seq._serial = next(self._serial)
+        self._sequences[seq] = None
+        self._heads.setdefault(seq.expectations[0].method, []).append(seq)
+
+    def _advance_sequence(self, seq, old_head):
+        """Update the head index after `old_head` has left the head of `seq`,
+        dropping `seq` if that emptied it.
+        """
+        self._drop_head(seq, old_head.method)
+
+        if not seq.expectations:
+            del self._sequences[seq]
+            return
+
+        self._insert_head(seq)
+
+    def _drop_head(self, seq, method):
+        heads = self._heads[method]
+        heads[:] = [x for x in heads if x is not seq]
+
+    def _insert_head(self, seq):
+        """File `seq` under the method of its head, in declaration order."""
+        heads = self._heads.setdefault(seq.expectations[0].method, [])
+        position = len(heads)
+        while position and heads[position - 1]._serial > seq._serial:
+            position -= 1
+        heads.insert(position, seq)
+
+    def _dispatch(self, method, args, kwargs):
+        """Satisfy the first expectation that matches a call to `method`."""
+        expectation = self._find(method, args, kwargs)
+        if expectation is None:
+            raise UnexpectedMethodCall(Expectation(self, method, args, kwargs))
+
+        return expectation._call(args, kwargs)
+
+    def _find(self, method, args, kwargs):
+        """Return the first active expectation of `method` that a call with
+        `args` and `kwargs` satisfies, or None.
+
+        Sequence heads win over free expectations, and earlier sequences and
+        expectations win over later ones, exactly as in
+        ``active_expectations()``. The parent's expectations, if there's a
+        parent, come last of all.
+        """
+        for seq in self._heads.get(method, ()):
+            if seq.expectations[0]._matches(args, kwargs):
+                return seq.expectations[0]
+
+        index = self._index.get(method)
+        if index is not None:
+            found = index.find(args, kwargs)
+            if found is not None:
+                return found
+
+        parent = self.parent
+        if parent is None:
+            return None
+
+        # The parent's own instrumentation only counts calls made to it.
+        return type(parent)._find(parent, method, args, kwargs)
+
+
+class ThreadSafeContext(Context):
+
+    """A ``Context`` that can be used from many threads at once.
+
+    Matching a call and retiring what it matched happen atomically. Calls are
+    serialized per mocked method, through a fixed number of striped locks, so
+    calls to different methods don't wait on each other. A call to a method
+    that heads some sequence also takes the one lock that guards sequences,
+    since retiring a sequence head moves that sequence on to another method.
+    """
+
+    def __init__(self, parent=None, stripes=16):
+        import threading
+
+        super(ThreadSafeContext, self).__init__(parent)
+        self._stripes = [threading.RLock() for x in range(stripes)]
+        self._sequence_lock = threading.RLock()
+
+    def _stripe(self, method):
+        return self._stripes[hash(method) % len(self._stripes)]
+
+    def _all_locks(self):
+        return _AllLocks(self._sequence_lock, self._stripes)
+
+    def retire_all_expectations(self):
+        with self._all_locks():
+            super(ThreadSafeContext, self).retire_all_expectations()
+
+    def snapshot(self):
+        with self._all_locks():
+            return super(ThreadSafeContext, self).snapshot()
+
+    def restore(self, snapshot):
+        with self._all_locks():
+            super(ThreadSafeContext, self).restore(snapshot)
+
+    def _active_unordered(self):
+        with self._all_locks():
+            return super(ThreadSafeContext, self)._active_unordered()
+
+    def _free_unordered(self):
+        with self._all_locks():
+            return super(ThreadSafeContext, self)._free_unordered()
+
+    def _add_expectation(self, expectation, key=_unknown_key):
+        with self._stripe(expectation.method):
+            super(ThreadSafeContext, self)._add_expectation(expectation, key)
+
+    def _add_expectations(self, method, expectations):
+        with self._stripe(method):
+            super(ThreadSafeContext, self)._add_expectations(method,
+                                                             expectations)
+
+    def _remove_expectation(self, expectation):
+        # Usually the stripe is held already, but a streaming sequence can
+        # free up an expectation of any method while it's refilled.
+        with self._stripe(expectation.method):
+            super(ThreadSafeContext, self)._remove_expectation(expectation)
+
+    def _add_to_sequence(self, seq, expectation):
+        with self._sequence_lock:
+            with self._stripe(expectation.method):
+                super(ThreadSafeContext, self)._add_to_sequence(
+                    seq, expectation
+                )
+
+    def _dispatch(self, method, args, kwargs):
+        stripe = self._stripe(method)
+
+        # The sequence lock is only needed if the call meets a sequence head,
+        # and is always taken before a stripe. Another call holding the
+        # sequence lock can make `method` head a sequence at any moment, so
+        # checking `_heads` up front isn't enough: if what matched turns out
+        # to be in a sequence, let go and try again with the sequence lock.
+        with stripe:
+            needs_sequence_lock = bool(self._heads.get(method))
+            if not needs_sequence_lock:
+                result = self._match_and_call(method, args, kwargs, False)
+                needs_sequence_lock = result is _needs_sequence_lock
+
+        if needs_sequence_lock:
+            with self._sequence_lock:
+                with stripe:
+                    result = self._match_and_call(method, args, kwargs)
+
+        # Outside of the locks, because describing the error takes them all.
+        if result is _no_match:
+            raise UnexpectedMethodCall(Expectation(self, method, args, kwargs))
+
+        return result
+
+    def _match_and_call(self, method, args, kwargs, sequence_locked=True):
+        expectation = self._find(method, args, kwargs)
+        if expectation is None:
+            return _no_match
+        if expectation._sequences and not sequence_locked:
+            return _needs_sequence_lock
+
+        return expectation._call(args, kwargs)
+
+
+class _AllLocks(object):
+
+    """Holds the sequence lock and every stripe of a ``ThreadSafeContext`` for
+    the length of a ``with`` block.
+    """
+
+    def __init__(self, sequence_lock, stripes):
+        self.sequence_lock = sequence_lock
+        self.stripes = stripes
+
+    def __enter__(self):
+        self.sequence_lock.acquire()
+        for stripe in self.stripes:
+            stripe.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for stripe in self.stripes:
+            stripe.release()
+        self.sequence_lock.release()
+
+
+_no_match = object()
+_needs_sequence_lock = object()
+
+
+class Snapshot(object):
+
+    """A point that a context can be rolled back to. See
+    ``Context.snapshot()``.
+
+    :Attributes:
+        - `context`: The context the snapshot was taken of.
+        - `mark`: How long the context's undo log was at the time.
+    """
+
+    __slots__ = ('context', 'mark')
+
+    def __init__(self, context, mark):
+        self.context = context
+        self.mark = mark
+
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+
+class MethodStats(object):
+
+    """What a context's ``DispatchStats`` know about one mocked method of one
+    mock.
+
+    :Attributes:
+        - `method`: The ``MockMethod``.
+        - `calls`: How many times it was called.
+        - `unexpected`: How many of those calls matched nothing.
+        - `retired`: How many expectations those calls retired.
+        - `scanned`: How many expectations were compared against the calls'
+          arguments. Expectations found through the exact-argument index
+          don't count.
+        - `matcher_calls`: How many times a ``matches`` argument was asked to
+          match.
+        - `match_time`: Seconds spent finding the matching expectation.
+        - `call_time`: Seconds spent on everything else: retiring, returning
+          or raising and, for a ``ThreadSafeContext``, waiting for locks.
+    """
+
+    __slots__ = ('method', 'calls', 'unexpected', 'retired', 'scanned',
+                 'matcher_calls', 'match_time', 'call_time')
+
+    def __init__(self, method):
+        self.method = method
+        self.calls = 0
+        self.unexpected = 0
+        self.retired = 0
+        self.scanned = 0
+        self.matcher_calls = 0
+        self.match_time = 0.0
+        self.call_time = 0.0
+
+    def describe(self):
+        method = self.method
+        mock = method.mock
+        if mock is None:
+            return method.name
+
+        return '%s.%s (mock at 0x%x)' % (
+            getattr(mock._mocked_cls, '__name__', '?'), method.name, id(mock)
+        )
+
+
+class DispatchStats(object):
+
+    """Instrumentation of the calls made through a context; see
+    ``Context.enable_stats()``.
+
+    :Attributes:
+        - `methods`: A dictionary mapping each ``MockMethod`` that has been
+          called to its ``MethodStats``.
+    """
+
+    def __init__(self):
+        self.methods = {}
+        self._lock = _thread.allocate_lock()
+
+    def total(self, name):
+        """The sum of the `name` counter over all methods."""
+        return sum(getattr(x, name) for x in list(self.methods.values()))
+
+    def report(self, limit=None):
+        """Return a table of the `limit` (by default, all) most called
+        methods.
+        """
+        rows = sorted(self.methods.values(),
+                      key=operator.attrgetter('calls'), reverse=True)
+        if limit is not None:
+            rows = rows[:limit]
+
+        line = '%9s %9s %9s %10s %10s %10s %10s  %s'
+        lines = [line % ('calls', 'missed', 'retired', 'scan/call',
+                         'match/call', 'match ms', 'call ms', 'method')]
+        for x in rows:
+            lines.append(line % (
+                x.calls, x.unexpected, x.retired,
+                '%.1f' % (x.scanned / float(x.calls)),
+                '%.1f' % (x.matcher_calls / float(x.calls)),
+                '%.3f' % (x.match_time * 1e3), '%.3f' % (x.call_time * 1e3),
+                x.describe(),
+            ))
+
+        return '\n'.join(lines)
+
+    def _add(self, method, call, elapsed):
+        with self._lock:
+            entry = self.methods.get(method)
+            if entry is None:
+                entry = self.methods[method] = MethodStats(method)
+
+            entry.calls += 1
+            entry.scanned += call.scanned
+            entry.matcher_calls += call.matcher_calls
+            entry.match_time += call.match_time
+            entry.call_time += elapsed - call.match_time
+
+            if call.found is None:
+                entry.unexpected += 1
+            elif call.found._num_times == 0:
+                entry.retired += 1
+
+
+class _CallRecord(object):
+
+    """The counters of one call being dispatched with stats on."""
+
+    __slots__ = ('scanned', 'matcher_calls', 'match_time', 'found')
+
+    def __init__(self):
+        self.scanned = 0
+        self.matcher_calls = 0
+        self.match_time = 0.0
+        self.found = None
+
+
+JournalEntry = collections.namedtuple('JournalEntry', [
+    'timestamp',    # When the call was made, as seconds since the epoch.
+    'method',       # The ``MockMethod`` that was called.
+    'arguments',    # The arguments, as the journal's capture policy says.
+    'expectation',  # The ``Expectation`` the call matched, or None.
+])
+
+
+class CallJournal(object):
+
+    """A ring buffer of the most recent calls made through a context; see
+    ``Context.enable_journal()``. Old calls fall off the end, so a journal
+    takes the same memory after a million calls as it does after `capacity`.
+
+    How a call's arguments are kept depends on `capture`:
+
+        - ``'reference'``: as an ``(args, kwargs)`` tuple of the very objects
+          passed, which is cheap but keeps them alive, and shows them as they
+          are now rather than as they were.
+        - ``'repr'``: as a string, abbreviated with ``reprlib``.
+        - ``'none'``: not at all.
+
+    :Attributes:
+        - `entries`: A deque of ``JournalEntry`` tuples, oldest first.
+    """
+
+    capture_policies = ('reference', 'repr', 'none')
+
+    def __init__(self, capacity=1000, capture='repr'):
+        if capture not in self.capture_policies:
+            raise ValueError('capture must be one of %s, not %r' % (
+                ', '.join(self.capture_policies), capture
+            ))
+
+        self.capacity = capacity
+        self.capture = capture
+        self.entries = collections.deque(maxlen=capacity)
+
+    def recent(self, count=None):
+        """Return the last `count` (by default, all) entries, oldest first."""
+        # Copying a deque is atomic, unlike iterating over one that other
+        # threads might be adding to.
+        entries = list(_copy_deque(self.entries))
+        if count is not None:
+            entries = entries[len(entries) - count:] if count else []
+
+        return entries
+
+    def format_entry(self, entry):
+        arguments = entry.arguments
+        if self.capture == 'reference':
+            args, kwargs = arguments
+            arguments = ', '.join([repr(a) for a in args] +
+                                  ['%s=%r' % x for x in kwargs.items()])
+        elif arguments is None:
+            arguments = '...'
+
+        method = entry.method
+        name = method.name
+        if method.mock is not None:
+            name = '%s.%s' % (
+                getattr(method.mock._mocked_cls, '__name__', '?'), name
+            )
+
+        return '%s.%03d %s(%s) -> %s' % (
+            time.strftime('%H:%M:%S', time.localtime(entry.timestamp)),
+            entry.timestamp * 1000 % 1000, name, arguments,
+            'matched' if entry.expectation is not None else 'unexpected',
+        )
+
+    def format(self, count=None):
+        """Return the last `count` (by default, all) entries, one per line."""
+        return '\n'.join(self.format_entry(x) for x in self.recent(count))
+
+    def _add(self, method, args, kwargs, expectation):
+        if self.capture == 'repr':
+            arguments = ', '.join(
+                [_short_repr(a) for a in args] +
+                ['%s=%s' % (k, _short_repr(v)) for k, v in kwargs.items()]
+            )
+        elif self.capture == 'reference':
+            arguments = (args, kwargs)
+        else:
+            arguments = None
+
+        self.entries.append(
+            JournalEntry(time.time(), method, arguments, expectation)
+        )
+
+
+_repr = None
+
+
+def _short_repr(value):
+    global _repr
+
+    if _repr is None:
+        try:
+            import reprlib
+        except ImportError:
+            import repr as reprlib
+        _repr = reprlib.Repr().repr
+
+    return _repr(value)
+
+
+def _copy_deque(deque):
+    try:
+        return deque.copy()
+    except AttributeError:
+        # Python 2.
+        import copy
+        return copy.copy(deque)
+
+
+class _Recording(_thread._local):
+    call = None
+
+# The call this thread is dispatching with stats on, if any.
+_recording = _Recording()
+
+_instrument_lock = _thread.allocate_lock()
+_instrument_users = 0
+
+
+def _instrument_matching(delta):
+    """Count matching work for the contexts that have stats on.
+
+    While any context does, ``Expectation._matches`` and ``matches.__eq__``
+    are replaced with versions that also count themselves against the call
+    being recorded on this thread. Otherwise they're left alone, so that
+    nobody else pays for the counting.
+    """
+    global _instrument_users
+
+    with _instrument_lock:
+        before = _instrument_users
+        _instrument_users += delta
+
+        if not before and _instrument_users:
+            Expectation._matches = _counting_matches
+            matches.__eq__ = _counting_eq
+        elif before and not _instrument_users:
+            Expectation._matches = _plain_matches
+            matches.__eq__ = _plain_eq
+
+
+def _counting_matches(self, args, kwargs):
+    call = _recording.call
+    if call is not None:
+        call.scanned += 1
+
+    return _plain_matches(self, args, kwargs)
+
+
+def _counting_eq(self, other):
+    call = _recording.call
+    if call is not None:
+        call.matcher_calls += 1
+
+    return _plain_eq(self, other)
+
+
+class _Chain(object):
+
+    """An intrusive doubly linked list of expectations.
+
+    Expectations are linked through their own `_prev` and `_next` attributes
+    and remember which chain they're on in `_chain`, so that removal is O(1)
+    and goes by identity. An expectation can be on at most one chain.
+    """
+
+    __slots__ = ('first', 'last')
+
+    def __init__(self):
+        self.first = None
+        self.last = None
+
+    def __iter__(self):
+        expectation = self.first
+        while expectation is not None:
+            yield expectation
+            expectation = expectation._next
+
+    def append(self, expectation):
+        expectation._chain = self
+        expectation._prev = self.last
+        expectation._next = None
+
+        if self.last is None:
+            self.first = expectation
+        else:
+            self.last._next = expectation
+        self.last = expectation
+
+    def remove(self, expectation):
+        if expectation._prev is None:
+            self.first = expectation._next
+        else:
+            expectation._prev._next = expectation._next
+
+        if expectation._next is None:
+            self.last = expectation._prev
+        else:
+            expectation._next._prev = expectation._prev
+
+        expectation._chain = expectation._prev = expectation._next = None
+
+    def relink(self, expectation, prev, next):
+        """Undo ``remove()``, given the neighbours `expectation` had then."""
+        expectation._chain = self
+        expectation._prev = prev
+        expectation._next = next
+
+        if prev is None:
+            self.first = expectation
+        else:
+            prev._next = expectation
+
+        if next is None:
+            self.last = expectation
+        else:
+            next._prev = expectation
+
+
+class _MethodIndex(object):
+
+    """The free expectations of a single mocked method.
+
+    Expectations whose arguments are all plain literals (see ``exact_key``)
+    are filed in a hash table of chains keyed by their arguments, so matching
+    a call against them is a dictionary lookup. Everything else (``matches``
+    wrappers, unhashable or user-defined values) is kept on a chain that's
+    scanned in order. Every expectation carries the context's declaration
+    serial, which is what keeps the two kinds in first-match order.
+    """
+
+    __slots__ = ('exact', 'scan')
+
+    def __init__(self):
+        self.exact = {}
+        self.scan = _Chain()
+
+    def __iter__(self):
+        for expectation in self.scan:
+            yield expectation
+        for chain in self.exact.values():
+            for expectation in chain:
+                yield expectation
+
+    def add(self, expectation, key=_unknown_key):
+        if key is _unknown_key:
+            key = exact_key(expectation.args, expectation.kwargs)
+        expectation._key = key
+
+        if expectation._key is None:
+            # Scanned expectations get compared over and over, so compile
+            # them now. The rest only get compiled if they ever need to be.
+            if expectation._matcher is None:
+                expectation._compile()
+            self.scan.append(expectation)
+        else:
+            chain = self.exact.get(expectation._key)
+            if chain is None:
+                chain = self.exact[expectation._key] = _Chain()
+            chain.append(expectation)
+
+    def extend(self, expectations, serial):
+        """``add()`` each of `expectations`, numbering them from `serial`."""
+        exact = self.exact
+        for expectation in expectations:
+            expectation._serial = next(serial)
+            key = expectation._key = exact_key(expectation.args,
+                                               expectation.kwargs)
+            if key is None:
+                if expectation._matcher is None:
+                    expectation._compile()
+                self.scan.append(expectation)
+                continue
+
+            chain = exact.get(key)
+            if chain is None:
+                chain = exact[key] = _Chain()
+            chain.append(expectation)
+
+    def remove(self, expectation):
+        chain = expectation._chain
+        chain.remove(expectation)
+
+        if chain.first is None and self.exact.get(expectation._key) is chain:
+            del self.exact[expectation._key]
+
+    def relink(self, expectation, chain, prev, next):
+        """Undo ``remove()``, given the chain and neighbours `expectation` had
+        then.
+        """
+        chain.relink(expectation, prev, next)
+
+        if expectation._key is not None:
+            self.exact[expectation._key] = chain
+
+    def find(self, args, kwargs):
+        key = exact_key(args, kwargs)
+        if key is not None:
+            chain = self.exact.get(key)
+            found = chain.first if chain is not None else None
+        else:
+            # The call's arguments can't be hashed reliably, so the exact
+            # expectations have to be compared the slow way.
+            found = None
+            for chain in self.exact.values():
+                for expectation in chain:
+                    if expectation._matches(args, kwargs):
+                        if (found is None or
+                                expectation._serial < found._serial):
+                            found = expectation
+                        break
+
+        expectation = self.scan.first
+        while expectation is not None:
+            if found is not None and expectation._serial > found._serial:
+                break
+            if expectation._matches(args, kwargs):
+                return expectation
+            expectation = expectation._next
+
+        return found
 
 
 class matches(object):
@@ -470,11 +1922,15 @@ class Sequence(object):
     not all have to come from the same mock object.
 
     :Attributes:
-        - `expectations`: a list of ``Expectation`` instances
+        - `expectations`: a deque of ``Expectation`` instances, whose head is
+          never retired. Expectations that retire through some other sequence
+          while they're further back are skipped once they reach the head.
     """
 
+    __slots__ = ('expectations', 'context', '_serial')
+
     def __init__(self):
-        self.expectations = []
+        self.expectations = collections.deque()
         self.context = None
 
     def add_expectation(self, context, expectation):
@@ -483,18 +1939,134 @@ class Sequence(object):
         elif self.context is not context:
             raise MockError('Sequences must live in only one context.')
 
-        self.expectations.append(expectation)
+        context._add_to_sequence(self, expectation)
+
+    def _retire(self, expectation):
+        """Pop `expectation`, which has just retired, if it's our head."""
+        expectations = self.expectations
+        if not expectations or expectations[0] is not expectation:
+            return
+
+        expectations.popleft()
+        while expectations and expectations[0]._retired:
+            expectations.popleft()
 
-        if expectation in context.expectations:
-            self.context.expectations.remove(expectation)
-        if self not in context.sequences:
-            self.context.sequences.append(self)
+        self.context._advance_sequence(self, expectation)
+
+
+class StreamingSequence(Sequence):
+
+    """A ``Sequence`` that reads its expectations from an iterable of `steps`
+    as it goes, holding no more than `window` of them at once. However long
+    the steps go on, a streaming sequence takes the same memory, and a call
+    that doesn't match its head fails just as it would for a ``Sequence``.
+
+    Each step is either an ``Expectation`` that hasn't been added to a context
+    yet, or a row of ``(method, args[, kwargs[, returns]])``, where `method`
+    is a mocked method::
+
+        def transcript():
+            for request, response in load_session('session.log'):
+                yield (conn.send, (request,))
+                yield (conn.recv, (), None, response)
+
+        StreamingSequence(transcript())
+
+    The steps can't be added to any other way, so ``in_sequence()`` raises
+    ``MockError`` on a streaming sequence. Restoring a ``Context.snapshot()``
+    puts back the expectations that calls used up, but doesn't rewind the
+    steps.
+    """
+
+    __slots__ = ('_steps', '_window')
+
+    def __init__(self, steps, window=16):
+        super(StreamingSequence, self).__init__()
+        self._steps = iter(steps)
+        self._window = window
+
+        # Check the whole first window before adding any of it, so that a step
+        # from another context doesn't leave half a sequence behind.
+        expectations = [self._expectation(step)
+                        for step in itertools.islice(self._steps, window)]
+        for expectation in expectations:
+            if expectation.context is not expectations[0].context:
+                raise MockError('Sequences must live in only one context.')
+
+        for expectation in expectations:
+            Sequence.add_expectation(self, expectation.context, expectation)
+            expectation._is_in_sequence = True
+
+    def add_expectation(self, context, expectation):
+        raise MockError("Streaming sequences only take expectations from "
+                        "their steps.")
+
+    def _expectation(self, step):
+        if isinstance(step, Expectation):
+            return step
+
+        method = step[0]
+        context = method.context
+        if context.frozen:
+            context = context._routed_context()
+        if self.context is not None and context is not self.context:
+            raise MockError('Sequences must live in only one context.')
+
+        args = step[1]
+        if type(args) is not tuple:
+            args = tuple(args)
+        expectation = method.expectation_class(
+            context, method, args, (len(step) > 2 and step[2]) or {}
+        )
+        if len(step) > 3:
+            expectation.return_val = step[3]
+
+        return expectation
+
+    def _retire(self, expectation):
+        expectations = self.expectations
+        if not expectations or expectations[0] is not expectation:
+            return
+
+        expectations.popleft()
+        try:
+            while True:
+                self._refill()
+                if not expectations or not expectations[0]._retired:
+                    break
+                expectations.popleft()
+        finally:
+            # If reading a step failed, the sequence still has to move on (or
+            # go away), or the context would be left with an empty head.
+            while expectations and expectations[0]._retired:
+                expectations.popleft()
+            self.context._advance_sequence(self, expectation)
+
+    def _refill(self):
+        """Read steps until the window is full again or they run out."""
+        expectations = self.expectations
+        while len(expectations) < self._window:
+            step = next(self._steps, None)
+            if step is None:
+                return
+
+            expectation = self._expectation(step)
+            if expectation.context is not self.context:
+                raise MockError('Sequences must live in only one context.')
+            if expectation._chain is not None:
+                # It was declared with ``expect()``, so it's free as well.
+                self.context._remove_expectation(expectation)
+            expectation._sequences += (self,)
+            expectation._is_in_sequence = True
+            expectations.append(expectation)
 
 
 class Sum(object):
 
     """True if all the calls to add() sum to a given value."""
 
+    __slots__ = ('expected', 'actual')
+
     def __init__(self, args, kwargs):
         self.expected = (list(args), kwargs)
         self.actual = None
@@ -509,7 +2081,7 @@ class Sum(object):
             )
 
         if self.actual is None:
-            self.actual = (list(args), kwargs)
+            self.actual = (list(args), dict(kwargs))
         else:
             act_args, act_kwargs = self.actual
 
@@ -522,6 +2094,8 @@ class Sum(object):
     def __nonzero__(self):
         return self.expected == self.actual
 
+    __bool__ = __nonzero__
+
 
 class Expectation(object):
 
@@ -529,8 +2103,18 @@ class Expectation(object):
     arguments (and returning a particular value to the caller) a particular
     number of times. Any constraint that cannot be met with those three
     criteria should be met with a ``Sequence`` of expectations.
+
+    Expectations are slotted, because big suites keep hundreds of thousands of
+    them alive at once. On 64-bit CPython 3.11, an expectation of ``foo(n)``
+    costs about 440 bytes all told, including its share of the dispatch index
+    (``python -m ditto.bench`` measures this).
     """
 
+    __slots__ = ('context', 'method', 'args', 'kwargs', 'return_val',
+                 'raises_exception', '_num_times', '_is_in_sequence',
+                 '_sequences', '_retired', '_is_optional', '_sum_barrier',
+                 '_serial', '_key', '_chain', '_prev', '_next', '_matcher')
+
     infinite = object()
 
     def __init__(self, context, method, args, kwargs):
@@ -543,8 +2127,16 @@ class Expectation(object):
         self.raises_exception = None
         self._num_times = 1
         self._is_in_sequence = False
+        self._sequences = ()
+        self._retired = False
         self._is_optional = False
         self._sum_barrier = True
+        self._serial = None
+        self._key = None
+        self._chain = None
+        self._prev = None
+        self._next = None
+        self._matcher = None
 
     def returns(self, value):
         if self.raises_exception is not None:
@@ -592,7 +2184,35 @@ class Expectation(object):
 
         return self
 
-    def _call(self, *args, **kwargs):
+    def _matches(self, args, kwargs):
+        """True if a call with `args` and `kwargs` satisfies this expectation.
+        """
+        matcher = self._matcher
+        if matcher is None:
+            matcher = self._compile()
+
+        if matcher is False:
+            # XXX. Be Careful. Because we may contain `matches` instances, you
+            # have to make sure the == ends up with the `matches` on the
+            # left-hand size, because he's the one that needs his __eq__
+            # method invoked, since he's the one that knows how to match
+            # himself against arbitrary objects using hamcrest. That's why
+            # this is `self.args == args` and never `args == self.args`.
+            # The keywords go first: they're all literals here, and a call
+            # with the wrong keyword names mustn't get as far as a matcher.
+            return self.kwargs == kwargs and self.args == args
+
+        return matcher(args, kwargs)
+
+    def _compile(self):
+        """Compile this expectation's arguments (see ``compile_matcher``) into
+        `_matcher`, which is False if plain equality is best.
+        """
+        self._matcher = compile_matcher(self.args, self.kwargs) or False
+
+        return self._matcher
+
+    def _call(self, args, kwargs):
         """Let this expectation know that it's been called. Only call one of
         these functions per method call into a mock object!! By calling this
         function, you're telling the expectation to retire itself, if
@@ -606,6 +2226,17 @@ class Expectation(object):
             configured to return, or it raises the exception that it's been
             configured to raise
         """
+        self._consume(args, kwargs)
+
+        if self.raises_exception is not None:
+            raise self.raises_exception
+
+        return self.return_val
+
+    def _consume(self, args, kwargs):
+        """Count a call against this expectation, retiring it if that was the
+        last one it needed.
+        """
         if not self._sum_barrier:
             self._sum_barrier.add(args, kwargs)
 
@@ -614,23 +2245,11 @@ class Expectation(object):
 
             if self._num_times == 0:
                 if self._is_in_sequence:
-                    sequences_to_remove = []
-                    for seq in self.context.sequences:
-                        if self in seq.expectations:
-                            seq.expectations.remove(self)
-
-                            if not seq.expectations:
-                                sequences_to_remove.append(seq)
-
-                    for seq in sequences_to_remove:
-                        self.context.sequences.remove(seq)
+                    self._retired = True
+                    for seq in self._sequences:
+                        seq._retire(self)
                 else:
-                    self.context.expectations.remove(self)
-
-        if self.raises_exception is not None:
-            raise self.raises_exception
-
-        return self.return_val
+                    self.context._remove_expectation(self)
 
     def __str__(self):
         return '<Expected %s>' % (method_to_str(
@@ -644,9 +2263,128 @@ class Expectation(object):
                self.args == other.args and self.kwargs == other.kwargs
 
 
+_plain_matches = Expectation.__dict__['_matches']
+_plain_eq = matches.__dict__['__eq__']
+
+
 default_context = Context()
 
 
+class _ThreadLocalVar(object):
+
+    """Stands in for ``contextvars.ContextVar`` where that module doesn't
+    exist: each thread sees its own value. The token ``set`` returns is just
+    the previous value.
+    """
+
+    def __init__(self, name, default=None):
+        self.name = name
+        self._default = default
+        self._local = _thread._local()
+
+    def get(self):
+        return getattr(self._local, 'value', self._default)
+
+    def set(self, value):
+        token = self.get()
+        self._local.value = value
+        return token
+
+    def reset(self, token):
+        self._local.value = token
+
+
+# Both made by the first use_context to be entered, so that nobody who doesn't
+# scope contexts has to import contextvars. _scope_tokens holds the tokens of
+# the use_context scopes that are open, as a linked stack of (token, rest)
+# pairs, so that each thread or task exits the scopes it entered even when
+# they share a use_context instance.
+_context_var = None
+_scope_tokens = None
+_scope_vars_lock = _thread.allocate_lock()
+
+
+def _scope_vars():
+    global _context_var, _scope_tokens
+
+    with _scope_vars_lock:
+        if _context_var is None:
+            try:
+                from contextvars import ContextVar
+            except ImportError:
+                ContextVar = _ThreadLocalVar
+            _scope_tokens = ContextVar('ditto_scope_tokens', default=None)
+            _context_var = ContextVar('ditto_context', default=None)
+
+    return _context_var, _scope_tokens
+
+
+def current_context():
+    """Return the context that new mocks are created in: the one scoped by
+    the innermost enclosing ``use_context``, or ``default_context`` outside of
+    any.
+    """
+    if _context_var is None:
+        return default_context
+
+    context = _context_var.get()
+    if context is None:
+        return default_context
+    return context
+
+
+class use_context(object):
+
+    """Scopes ``current_context()``, and so the context that mocks are
+    created in, to a block of code. As a context manager it yields the scoped
+    context::
+
+        with use_context() as context:
+            m = Mock(Foo)  # m is in context, not default_context
+
+    As a decorator, each call of the decorated function, or each run of the
+    decorated coroutine function's coroutine, has its own scope::
+
+        @use_context()
+        def test_foo():
+            ...
+
+    If you don't pass a context, every scope gets a fresh ``Context``. The
+    scope follows ``contextvars`` semantics, so threads and asyncio tasks
+    running concurrently each see their own; on pythons without
+    ``contextvars`` it's per thread.
+    """
+
+    def __init__(self, context=None):
+        self.context = context
+
+    def __enter__(self):
+        context = self.context
+        if context is None:
+            context = Context()
+        context_var, scope_tokens = _scope_vars()
+        scope_tokens.set((context_var.set(context), scope_tokens.get()))
+        return context
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        token, rest = _scope_tokens.get()
+        _scope_tokens.set(rest)
+        _context_var.reset(token)
+
+    def __call__(self, func):
+        import functools
+
+        if is_coroutine_function(func):
+            from ditto.aio import _scoped
+            return _scoped(func, self.context)
+
+        @functools.wraps(func)
+        def scoped(*args, **kwargs):
+            with use_context(self.context):
+                return func(*args, **kwargs)
+        return scoped
+
+
 class MockMethod(object):
 
     """In every mock of some class, that class's real methods are replaced with
@@ -659,73 +2397,376 @@ class MockMethod(object):
         expectation instances. 
     """
 
-    def __init__(self, context=default_context, name='anonymous', mock=None):
+    __slots__ = ('context', 'name', 'mock')
+
+    expectation_class = Expectation
+
+    def __init__(self, context=None, name='anonymous', mock=None):
+        if context is None:
+            context = current_context()
         self.context = context
         self.name = name
         self.mock = mock
 
     def __call__(self, *args, **kwargs):
-        possible = self.context.active_expectations()
-
-        test = Expectation(self.context, self, args, kwargs)
-
-        try:
-            # XXX. Be Careful. Because `possible` may contain `matches`
-            # instances, you have to make sure the == ends up with the
-            # `matches` on the left-hand size, because he's the one that needs
-            # his __eq__ method invoked, since he's the one that knows how to
-            # match himself against arbitrary objects using hamcrest. The
-            # python expression "test in possible" won't work, for example,
-            # because it calls the __eq__ method of `test` against every member
-            # of possible. It's possible we should investigate a better way of
-            # doing this, because I might be making an assumption that this
-            # won't change in the future.
-            return possible[possible.index(test)]._call(*args, **kwargs)
-        except ValueError:
-            raise UnexpectedMethodCall(test)
+        return self.context._dispatch(self, args, kwargs)
 
     def expect(self, *args, **kwargs):
         args_matcher = kwargs.pop('_args_matcher', None)
         kwargs_matcher = kwargs.pop('_kwargs_matcher', None)
 
-        e = Expectation(self.context, self, args_matcher or args,
-                        kwargs_matcher or kwargs)
-        self.context.expectations.append(e)
+        context = self.context
+        if context.frozen:
+            context = context._routed_context()
+
+        e = self.expectation_class(context, self, args_matcher or args,
+                                   kwargs_matcher or kwargs)
+        context._add_expectation(e)
 
         return e
 
+    def expect_many(self, rows):
+        """Expect a whole table of calls at once, and return the list of new
+        expectations.
+
+        Each row is ``(args, kwargs)``, ``(args, kwargs, returns)`` or
+        ``(args, kwargs, returns, times)``, where `kwargs` may be None, and a
+        `times` of ``Expectation.infinite`` means ``infinite_times()``. So::
+
+            m.foo.expect_many([((1,), None, 'one'),
+                               ((2,), {'x': 3}, 'two', 4)])
+
+        is the same as::
+
+            m.foo.expect(1).returns('one')
+            m.foo.expect(2, x=3).returns('two').times(4)
+
+        only quicker, because all the expectations go into the context's
+        indexes in one go.
+        """
+        context = self.context
+        if context.frozen:
+            context = context._routed_context()
+
+        expectation_class = self.expectation_class
+        infinite = Expectation.infinite
+        expectations = []
+        for row in rows:
+            args = row[0]
+            if type(args) is not tuple:
+                args = tuple(args)
+            e = expectation_class(context, self, args, row[1] or {})
+
+            if len(row) > 2:
+                e.return_val = row[2]
+                if len(row) > 3:
+                    e._num_times = row[3]
+                    if row[3] is infinite:
+                        e._is_optional = True
+
+            expectations.append(e)
+
+        context._add_expectations(self, expectations)
+
+        return expectations
+
+
+# The protocol methods of async context managers and iterators. Mocking them
+# is harmless, since ordinary objects don't have them, so the default selector
+# picks them whenever the mocked class defines them.
+_async_protocol_names = frozenset(['__aenter__', '__aexit__', '__aiter__',
+                                   '__anext__'])
+
+# ``inspect.CO_COROUTINE``, without importing ``inspect``.
+_CO_COROUTINE = 0x80 if sys.version_info >= (3, 5) else 0
+
 
 def default_method_selector(mocked_cls, func_name):
     func = getattr(mocked_cls, func_name, None)
-    return callable(func) and '__' not in func_name
+    return callable(func) and ('__' not in func_name or
+                               func_name in _async_protocol_names)
+
+
+def is_coroutine_function(func):
+    """True if `func` is an ``async def`` function or a method of one."""
+    func = getattr(func, '__func__', func)
+    code = getattr(func, '__code__', None)
+    return code is not None and bool(code.co_flags & _CO_COROUTINE)
+
+
+# Maps a mocked class to {method selector: entry}, where an entry is the list
+# [fingerprint, names, {Mock base class: (class level count, subclass)}]. Both
+# levels are weakly keyed, so caching never keeps a class or a selector alive.
+# Mocked things that can't be weakly referenced (modules, on python 2) are
+# pinned in a regular dict instead. Made by the first mock, as is
+# _WeakKeyDictionary.
+_method_plans = None
+_pinned_method_plans = {}
+_WeakKeyDictionary = None
+
+
+def _new_method_plans():
+    global _method_plans, _WeakKeyDictionary
+
+    from weakref import WeakKeyDictionary
+    _WeakKeyDictionary = WeakKeyDictionary
+    _method_plans = WeakKeyDictionary()
+
+    return _method_plans
+
+
+# Bumped by forget_method_plan(), which makes every cached plan stale.
+_plan_generation = 0
+
+
+def _fingerprint(mocked_cls):
+    # Only the size of the mocked class's own dictionary, so that checking a
+    # cached plan costs the same however big the class is. Anything that
+    # looks at every attribute, or at the classes it inherits from, costs
+    # most of what the cache saves.
+    return _plan_generation, len(getattr(mocked_cls, '__dict__', ()))
+
+
+def _plan_entry(mocked_cls, method_selector):
+    fingerprint = _fingerprint(mocked_cls)
+    method_plans = _method_plans
+    if method_plans is None:
+        method_plans = _new_method_plans()
+
+    try:
+        try:
+            plans = method_plans.get(mocked_cls)
+            if plans is None:
+                plans = method_plans[mocked_cls] = _WeakKeyDictionary()
+        except TypeError:
+            plans = _pinned_method_plans.get(mocked_cls)
+            if plans is None:
+                plans = _pinned_method_plans[mocked_cls] = \
+                    _WeakKeyDictionary()
+
+        entry = plans.get(method_selector)
+    except TypeError:
+        # Either the class is unhashable or the selector can't be weakly
+        # referenced.
+        plans = entry = None
+
+    if entry is None or entry[0] != fingerprint:
+        names = frozenset(name for name in dir(mocked_cls)
+                          if method_selector(mocked_cls, name))
+        entry = [fingerprint, names, {}]
+
+        if plans is not None:
+            plans[method_selector] = entry
+
+    return entry
+
+
+def method_plan(mocked_cls, method_selector=default_method_selector):
+    """Return the frozenset of names in `mocked_cls` that `method_selector`
+    says should be mocked.
+
+    The answer is cached per class and selector, so that mocking the same
+    class over and over doesn't run ``dir()`` and the selector every time. A
+    cached plan is thrown away when an attribute is added to or deleted from
+    the class itself. Rebinding one that's already there (as
+    ``mock.patch.object`` does) or changing anything the class inherits from
+    isn't noticed; call ``forget_method_plan`` after doing that.
+    """
+    return _plan_entry(mocked_cls, method_selector)[1]
+
+
+def forget_method_plan(mocked_cls=None):
+    """Throw away the cached plans (and generated ``Mock`` subclasses), so
+    that the next mock of any class looks at it afresh. Call this after
+    rebinding an attribute of a mocked class or of anything it inherits
+    from, or changing something a selector's answers depend on; see
+    ``method_plan``. `mocked_cls`, if given, has its plans dropped right away
+    rather than when it's next mocked.
+    """
+    global _plan_generation
+
+    _plan_generation += 1
+
+    for plans in (_method_plans or {}, _pinned_method_plans):
+        try:
+            plans.pop(mocked_cls, None)
+        except TypeError:
+            pass
 
 
 class_level_mock_names = []
 
 
+# Names that a generated ``Mock`` subclass won't mock no matter what the
+# selector says, because the mock needs them to work at all.
+_reserved_names = frozenset([
+    '__class__', '__delattr__', '__dict__', '__doc__', '__getattr__',
+    '__getattribute__', '__init__', '__init_subclass__', '__module__',
+    '__new__', '__setattr__', '__slots__', '__subclasshook__', '__weakref__',
+    '_class_level_mocks', '_context', '_method_classes', '_method_selector',
+    '_mocked_cls', '_mocked_names',
+])
+
+def _is_identifier(name):
+    try:
+        return name.isidentifier()
+    except AttributeError:
+        # Python 2. Importing re up front costs more than all the rest of
+        # ditto's imports put together, so it waits until it's needed.
+        import re
+        return re.match(r'[A-Za-z_][A-Za-z0-9_]*$', name) is not None
+
+
+class _SpecialMockMethod(object):
+
+    """Class-level home of a mocked method whose name can't be a slot.
+
+    Python only looks "protocol" methods (``__enter__`` and the like) up on the
+    type, so those have to be descriptors on the generated class. The
+    ``MockMethod`` itself is created on first access and kept in the mock's
+    ``__dict__``.
+    """
+
+    def __init__(self, name, method_class=MockMethod):
+        self.name = name
+        self.method_class = method_class
+
+    def __get__(self, instance, cls):
+        if instance is None:
+            return self
+
+        mockmethod = instance.__dict__.get(self.name)
+        if mockmethod is None:
+            mockmethod = instance.__dict__[self.name] = self.method_class(
+                instance._context, self.name, instance
+            )
+
+        return mockmethod
+
+
+def mock_class(mocked_cls, method_selector=default_method_selector, base=None):
+    """Return the ``Mock`` subclass whose instances mock `mocked_cls`.
+
+    ``Mock(Foo)`` is really an instance of this class, which is generated once
+    per mocked class and selector and then cached (see ``method_plan``). Each
+    mockable name is a slot, filled in with a ``MockMethod`` the first time
+    it's looked up, so instances stay small and a mocked method is a plain slot
+    read after that. Names python only looks up on the type, like
+    ``__enter__`` and ``__exit__``, get a descriptor on the generated class
+    instead, which means a selector that picks them makes them work with
+    ``with`` and friends for this mocked class only. Names that are coroutine
+    functions on `mocked_cls` are mocked with ``ditto.aio.AsyncMockMethod``.
+    """
+    base = base or Mock
+    entry = _plan_entry(mocked_cls, method_selector)
+
+    cached = entry[2].get(base)
+    if cached is not None and cached[0] == len(class_level_mock_names):
+        return cached[1]
+
+    namespace = {'__module__': base.__module__}
+    slots = []
+    mocked = []
+    method_classes = {}
+    for name in sorted(entry[1]):
+        if name in _reserved_names or name in class_level_mock_names:
+            continue
+
+        method_class = MockMethod
+        if is_coroutine_function(getattr(mocked_cls, name, None)):
+            from ditto.aio import AsyncMockMethod
+            method_class = method_classes[name] = AsyncMockMethod
+
+        if name.startswith('__') or not _is_identifier(name):
+            namespace[name] = _SpecialMockMethod(name, method_class)
+        else:
+            slots.append(name)
+        mocked.append(name)
+
+    namespace['__slots__'] = tuple(slots)
+    namespace['_mocked_names'] = frozenset(mocked)
+    namespace['_method_classes'] = method_classes
+    # Only a weak reference, since the class is cached under the selector and
+    # would otherwise keep it alive. Selectors that can't be weakly referenced
+    # aren't cached at all.
+    import weakref
+
+    try:
+        namespace['_method_selector'] = weakref.ref(method_selector)
+    except TypeError:
+        namespace['_method_selector'] = staticmethod(lambda: method_selector)
+
+    generated = type(base)(
+        str('%s[%s]' % (base.__name__, getattr(mocked_cls, '__name__', '?'))),
+        (base,), namespace
+    )
+    entry[2][base] = (len(class_level_mock_names), generated)
+
+    return generated
+
+
+def _constructor(cls):
+    """Return the class whose ``__init__`` constructs instances of `cls`."""
+    for klass in cls.__mro__:
+        if '__init__' in klass.__dict__:
+            return klass
+
+
 class Mock(object):
 
+    __slots__ = ('_mocked_cls', '_context', '_class_level_mocks', '__dict__',
+                 '__weakref__')
+
+    def __new__(cls, *args, **kwargs):
+        # A subclass with a constructor of its own can't be swapped for a
+        # generated class, because there's no telling what its arguments are.
+        # Its instances work out what to mock in ``__init__`` instead.
+        if '_mocked_names' not in cls.__dict__ and \
+                (cls is Mock or _constructor(cls) is Mock):
+            mocked_cls = args[0] if args else kwargs.get('_mocked_cls')
+            if mocked_cls is not None:
+                method_selector = args[1] if len(args) > 1 else \
+                    kwargs.get('_method_selector', default_method_selector)
+                cls = mock_class(mocked_cls, method_selector, cls)
+
+        return super(Mock, cls).__new__(cls)
+
     def __init__(self, _mocked_cls, _method_selector=default_method_selector,
-                 _context=default_context, **kwargs):
+                 _context=None, _lazy=True, **kwargs):
         """Create a mock instance that's based on some other class.
 
+        The new mock is an instance of a generated subclass of ``Mock`` (see
+        ``mock_class``), unless it's an instance of a subclass of ``Mock``
+        that has a constructor of its own. Those stay instances of the
+        subclass, and keep their mocked methods in their ``__dict__``.
+
         :Parameters:
             - `_method_selector`: This is a function(cls, name_string) that
               should return True or False: True if name_string is a name of a
               function in cls that *should* be mocked, False otherwise.
             - `_context`: The instance of ``Context`` that this mock object is
-              operating within. If you don't specify, will be the default
-              singleton define in the ``mock`` module.
+              operating within. If you don't specify, will be
+              ``current_context()``: ``default_context`` unless you're inside
+              a ``use_context`` scope.
+            - `_lazy`: If True (the default), each ``MockMethod`` is only
+              created the first time it's looked up. Pass False to create them
+              all up front.
         """
 
+        if _context is None:
+            _context = current_context()
         self._mocked_cls = _mocked_cls
         self._context = _context
         self._class_level_mocks = {}
 
-        for func_name in dir(_mocked_cls):
-            if _method_selector(_mocked_cls, func_name):
-                mockmethod = MockMethod(_context, func_name, self)
-                setattr(self, func_name, mockmethod)
+        if '_mocked_names' not in type(self).__dict__:
+            generated = mock_class(_mocked_cls, _method_selector)
+            self._mocked_names = generated._mocked_names
+            self._method_classes = generated._method_classes
+
+        if not _lazy:
+            for func_name in self._mocked_names:
+                getattr(self, func_name)
 
         for func_name in class_level_mock_names:
             self._class_level_mocks[func_name] = MockMethod(
@@ -735,6 +2776,64 @@ class Mock(object):
         for name, value in kwargs.items():
             setattr(self, name, value)
 
+    def __getattr__(self, name):
+        # Only called when regular lookup fails, which for a mocked name means
+        # its slot hasn't been filled in yet.
+        cls = type(self)
+        mocked_names = getattr(cls, '_mocked_names', None)
+        if mocked_names is not None:
+            method_classes = cls._method_classes
+        else:
+            # A subclass with its own constructor; see ``__new__``.
+            mocked_names = self.__dict__.get('_mocked_names', ())
+            method_classes = self.__dict__.get('_method_classes', {})
+
+        if name in mocked_names:
+            method_class = method_classes.get(name, MockMethod)
+            mockmethod = method_class(self._context, name, self)
+            setattr(self, name, mockmethod)
+
+            return mockmethod
+
+        raise AttributeError(name)
+
+    def __reduce_ex__(self, protocol):
+        # Generated classes can't be looked up by name, so copies (and
+        # pickles) say how to generate the class again instead.
+        cls = type(self)
+        method_selector = None
+        if '_mocked_names' in cls.__dict__:
+            method_selector = cls._method_selector()
+
+        if method_selector is not None:
+            blank = (cls.__bases__[0], self._mocked_cls, method_selector)
+        else:
+            # Either not generated, or its selector is gone. A copy can still
+            # use the class itself.
+            blank = (cls,)
+
+        slots = {}
+        for klass in cls.__mro__:
+            for name in klass.__dict__.get('__slots__', ()):
+                if name in ('__dict__', '__weakref__'):
+                    continue
+                try:
+                    slots[name] = object.__getattribute__(self, name)
+                except AttributeError:
+                    pass
+
+        return (_blank_mock, blank, (dict(self.__dict__) or None, slots))
+
+
+def _blank_mock(cls, mocked_cls=None, method_selector=None):
+    """Return an uninitialized instance of `cls`, or of the class generated
+    from `cls` for `mocked_cls`, for ``copy`` and ``pickle`` to fill in.
+    """
+    if mocked_cls is not None:
+        cls = mock_class(mocked_cls, method_selector, cls)
+
+    return object.__new__(cls)
+
 
 def add_class_level_mock_method(method_name):
     """Force the Mock class to declare a MockMethod.
@@ -753,6 +2852,10 @@ def add_class_level_mock_method(method_name):
       that your to-strings are getting called. It's probably not worth it. The
       best example of when you should use something like that is __enter__ and
       __exit__ on a mock that's used with the "with" keyword.
+
+    If only some mocked classes need the method, prefer a ``_method_selector``
+    that picks it: ``mock_class`` will then put it on those classes' generated
+    subclasses alone.
     """
     class SpecialMethod(object):
         def __get__(self, instance, cls):
@@ -768,3 +2871,182 @@ def add_class_level_mock_method(method_name):
     class_level_mock_names.append(method_name)
     setattr(Mock, method_name, SpecialMethod())
 
+
+# Expectation slots that say where an expectation stands rather than what it
+# expects. A prototype's clones start these afresh instead of copying them.
+_bookkeeping_slots = frozenset([
+    'context', 'method', '_is_in_sequence', '_sequences', '_retired',
+    '_sum_barrier', '_serial', '_key', '_chain', '_prev', '_next',
+])
+
+
+def _expectation_slots(expectation_class):
+    names = []
+    for cls in reversed(expectation_class.__mro__):
+        names.extend(cls.__dict__.get('__slots__', ()))
+
+    return names
+
+
+class _RecipeContext(Context):
+
+    """The private context that a ``Prototype`` records its expectations in.
+    """
+
+    sealed = False
+
+    def _add_expectation(self, expectation, key=_unknown_key):
+        if self.sealed:
+            raise MockError("Can't add to a prototype that's been cloned")
+        super(_RecipeContext, self)._add_expectation(expectation, key)
+
+    def _add_expectations(self, method, expectations):
+        if self.sealed:
+            raise MockError("Can't add to a prototype that's been cloned")
+        super(_RecipeContext, self)._add_expectations(method, expectations)
+
+    def _add_to_sequence(self, seq, expectation):
+        if self.sealed:
+            raise MockError("Can't add to a prototype that's been cloned")
+        super(_RecipeContext, self)._add_to_sequence(seq, expectation)
+
+    def _dispatch(self, method, args, kwargs):
+        raise MockError("Prototypes can't be called. Call a clone instead.")
+
+
+class Prototype(object):
+
+    """A recipe for a mock and its expectations, which can be stamped out as
+    many times as needed::
+
+        segment = Prototype(PdtsSeg)
+        segment.mock.send.expect().times(5)
+        segment.mock.send_new_data.expect(matches(anything())).times(3)
+
+        my_data = [{'id': n, 'segment': segment.clone()} for n in range(1000)]
+
+    Each clone is an independent ``Mock`` with its own copies of the
+    expectations (and sequences) declared on `mock`, just as if they'd been
+    declared on it directly. The first ``clone()`` compiles the recipe into a
+    plan, after which the prototype can't be changed: cloning then reuses the
+    generated mock class, the expectations' index keys and their compiled
+    matchers rather than working any of them out again.
+
+    :Attributes:
+        - `mock`: The template mock to declare expectations on. It lives in a
+          private context and can't be called.
+    """
+
+    def __init__(self, mocked_cls, method_selector=default_method_selector):
+        self.mock = Mock(mocked_cls, method_selector,
+                         _context=_RecipeContext())
+        self._plan = None
+
+    def clone(self, context=None, **attributes):
+        """Return a new mock with the prototype's expectations, in `context`
+        (by default, ``current_context()``). `attributes` are set on the mock,
+        as with ``Mock``.
+        """
+        if context is None:
+            context = current_context()
+
+        template = self.mock
+        mock = type(template)(template._mocked_cls, _context=context,
+                              **attributes)
+
+        return (self._plan or self._compile())(context, mock)
+
+    def _compile(self):
+        """Generate, once, the function that gives a new mock the prototype's
+        expectations. It creates the mocked methods and expectations directly,
+        filling in every slot with a precomputed value, and then indexes each
+        expectation under its precomputed key.
+        """
+        recipe = self.mock._context
+        recipe.sealed = True
+
+        declared = {}
+        for seq in recipe._sequences:
+            for expectation in seq.expectations:
+                declared[id(expectation)] = expectation
+        for expectation in recipe._free_unordered():
+            declared[id(expectation)] = expectation
+        declared = sorted(declared.values(),
+                          key=operator.attrgetter('_serial'))
+
+        mock_cls = type(self.mock)
+        namespace = {'Sum': Sum, 'Sequence': Sequence}
+        lines = ['add = context._add_expectation']
+
+        def constant(value):
+            name = 'c%d' % len(namespace)
+            namespace[name] = value
+            return name
+
+        methods = {}
+        for n, expectation in enumerate(declared):
+            name = expectation.method.name
+            method = methods.get(name)
+            if method is None:
+                method = methods[name] = 'm%d' % len(methods)
+                if name in class_level_mock_names:
+                    lines.append('%s = getattr(mock, %s)' % (
+                        method, constant(name)))
+                else:
+                    created = '%s(context, %s, mock)' % (
+                        constant(mock_cls._method_classes.get(name,
+                                                              MockMethod)),
+                        constant(name))
+                    if isinstance(mock_cls.__dict__.get(name),
+                                  _SpecialMockMethod):
+                        lines.append('%s = mock.__dict__[%s] = %s' % (
+                            method, constant(name), created))
+                    else:
+                        lines.append('%s = mock.%s = %s' % (method, name,
+                                                            created))
+
+            if expectation._matcher is None:
+                expectation._compile()
+            expectation_class = type(expectation)
+            fresh = expectation_class(recipe, expectation.method,
+                                      expectation.args, expectation.kwargs)
+
+            lines.append('e%d = %s.__new__(%s)' % (
+                n, constant(expectation_class), constant(expectation_class)
+            ))
+            for slot in _expectation_slots(expectation_class):
+                if slot == 'context':
+                    value = 'context'
+                elif slot == 'method':
+                    value = method
+                elif slot == '_sum_barrier' and \
+                        expectation._sum_barrier is not True:
+                    expected_args, expected_kwargs = \
+                        expectation._sum_barrier.expected
+                    value = 'Sum(%s, %s)' % (constant(tuple(expected_args)),
+                                             constant(expected_kwargs))
+                elif slot in _bookkeeping_slots:
+                    value = constant(getattr(fresh, slot))
+                else:
+                    value = constant(getattr(expectation, slot))
+                lines.append('e%d.%s = %s' % (n, slot, value))
+
+            lines.append('add(e%d, %s)' % (n, constant(
+                exact_key(expectation.args, expectation.kwargs)
+            )))
+
+        numbers = dict((id(x), n) for n, x in enumerate(declared))
+        for seq in recipe._sequences:
+            lines.append('seq = Sequence()')
+            lines.extend('e%d.in_sequence(seq)' % numbers[id(x)]
+                         for x in seq.expectations)
+
+        lines.append('return mock')
+
+        source = 'def clone(context, mock):\n%s\n' % '\n'.join(
+            '    ' + line for line in lines
+        )
+        exec(source, namespace)
+        self._plan = namespace['clone']
+
+        return self._plan
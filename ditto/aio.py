@@ -0,0 +1,129 @@
+# Copyright (C) 2010-2011 Cisco Systems, Inc
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# (1) Redistributions of source code must retain the above copyright notice,
+#     this list of conditions and the following disclaimer.
+#
+# (2) Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions and the following disclaimer in the documentation
+#     and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY CISCO SYSTEMS ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL CISCO SYSTEMS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are
+# those of the authors and should not be interpreted as representing official
+# policies, either expressed or implied, of Cisco Systems, Inc.
+
+"""\
+asyncio support, for python 3.5 and later.
+
+``Mock`` mocks each method that's a coroutine function on the mocked class
+(``async def``, including ``__aenter__``, ``__aexit__`` and ``__anext__``) with
+an ``AsyncMockMethod``. Calling one returns a coroutine, so the code under test
+awaits it just like the real thing::
+
+    class Client(object):
+        async def fetch(self, key):
+            ...
+
+    client = Mock(Client)
+    client.fetch.expect('a').returns(1).delays(0.5)
+    client.fetch.expect('b').raises(KeyError('b'))
+
+    assert await client.fetch('a') == 1  # after half a second
+    await client.fetch('b')              # raises KeyError
+
+The call is checked against expectations when it's made, not when it's
+awaited, exactly like a call to any other mocked method. An unexpected call
+fails right where it happens, and a ``Sequence`` is satisfied by the order in
+which calls are made, no matter how the resulting coroutines end up scheduled.
+Only the return value, the exception and the delay wait for the await. Delays
+are ``asyncio.sleep``, so they run on the event loop's clock and many
+concurrent tasks can wait on mocks without tying up a thread each.
+"""
+
+import asyncio
+import functools
+
+from ditto import Expectation, MockMethod, use_context
+
+
+class AsyncExpectation(Expectation):
+
+    """An ``Expectation`` of a call to a coroutine function. ``returns`` and
+    ``raises`` say what awaiting the call does, and ``delays`` how long it
+    takes to do it.
+    """
+
+    __slots__ = ('delay',)
+
+    def __init__(self, context, method, args, kwargs):
+        super(AsyncExpectation, self).__init__(context, method, args, kwargs)
+        self.delay = 0
+
+    def delays(self, seconds):
+        self.delay = seconds
+
+        return self
+
+    def _call(self, args, kwargs):
+        self._consume(args, kwargs)
+
+        return _result(self.return_val, self.raises_exception, self.delay)
+
+
+class AsyncMockMethod(MockMethod):
+
+    """The ``MockMethod`` of a coroutine function. Calling it returns a
+    coroutine that resolves the matched expectation.
+    """
+
+    __slots__ = ()
+
+    expectation_class = AsyncExpectation
+
+
+async def _result(value, exception, delay):
+    if delay:
+        await asyncio.sleep(delay)
+
+    if exception is not None:
+        raise exception
+
+    return value
+
+
+def _scoped(func, context):
+    """``use_context(context)(func)`` for a coroutine function `func`: the
+    scope has to be entered when the coroutine runs, not when it's created.
+    """
+    @functools.wraps(func)
+    async def scoped(*args, **kwargs):
+        with use_context(context):
+            return await func(*args, **kwargs)
+    return scoped
+
+
+def _verified(func):
+    """``ditto.testing.verify_expectations`` for a coroutine function."""
+    from ditto.testing import verify
+
+    @functools.wraps(func)
+    async def test(*args, **kwargs):
+        with use_context() as context:
+            result = await func(*args, **kwargs)
+            verify(context, getattr(func, '__name__', repr(func)))
+
+        return result
+    return test
@@ -0,0 +1,470 @@
+# Copyright (C) 2010-2011 Cisco Systems, Inc
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# (1) Redistributions of source code must retain the above copyright notice,
+#     this list of conditions and the following disclaimer.
+#
+# (2) Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions and the following disclaimer in the documentation
+#     and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY CISCO SYSTEMS ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL CISCO SYSTEMS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are
+# those of the authors and should not be interpreted as representing official
+# policies, either expressed or implied, of Cisco Systems, Inc.
+
+"""\
+Benchmarks for ditto's hot paths. Run them with::
+
+    python -m ditto.bench
+
+``-k`` picks benchmarks by name, and ``--json FILE`` saves the results, which
+you can later check a newer run against::
+
+    python -m ditto.bench --json old.json
+    ... change things ...
+    python -m ditto.bench --json new.json
+    python -m ditto.bench --compare old.json new.json
+
+Every result is a cost, so lower is better: seconds per operation, or bytes.
+``--compare`` exits with status 1 if anything got worse by more than
+``--threshold`` (10% by default).
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import gc
+import json
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from ditto import (Context, Expectation, Mock, Prototype, Sequence,
+                   StreamingSequence, ThreadSafeContext, UnexpectedMethodCall,
+                   forget_method_plan, matches)
+from ditto.matchers import anything, equal_to
+
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+# Maps a benchmark's name to (function, unit). The function takes no arguments
+# and returns the cost of one operation.
+BENCHMARKS = collections.OrderedDict()
+
+
+def benchmark(name, unit='s'):
+    def register(func):
+        BENCHMARKS[name] = (func, unit)
+        return func
+    return register
+
+
+class Subject(object):
+
+    def foo(self, *args, **kwargs):
+        pass
+
+
+def _method(self, *args, **kwargs):
+    pass
+
+
+# A class with a lot of methods.
+LargeSubject = type('LargeSubject', (object,),
+                    dict(('method%d' % n, _method) for n in range(200)))
+
+
+def _time_per_call(func, count):
+    start = _timer()
+    for x in range(count):
+        func()
+    return (_timer() - start) / count
+
+
+@benchmark('import.ditto')
+def import_time():
+    """Return the seconds a fresh interpreter takes to ``import ditto``."""
+    code = ('import time; timer = getattr(time, "perf_counter", time.time); '
+            'start = timer(); import ditto; print(timer() - start)')
+    return float(subprocess.check_output([sys.executable, '-c', code]))
+
+
+@benchmark('mock.construct.small')
+def construct_small(count=20000):
+    context = Context()
+    return _time_per_call(lambda: Mock(Subject, _context=context), count)
+
+
+@benchmark('mock.construct.large')
+def construct_large(count=20000):
+    context = Context()
+    return _time_per_call(lambda: Mock(LargeSubject, _context=context), count)
+
+
+@benchmark('mock.construct.large_cold')
+def construct_large_cold(count=2000):
+    """``mock.construct.large`` without the cached method plan, which is
+    thrown away before every mock.
+    """
+    context = Context()
+
+    def construct():
+        forget_method_plan(LargeSubject)
+        Mock(LargeSubject, _context=context)
+
+    return _time_per_call(construct, count)
+
+
+@benchmark('mock.construct.large_eager')
+def construct_large_eager(count=500):
+    context = Context()
+    return _time_per_call(
+        lambda: Mock(LargeSubject, _context=context, _lazy=False), count
+    )
+
+
+def _declare(mock):
+    mock.method1.expect().times(5)
+    mock.method2.expect(matches(anything())).times(3)
+    mock.method3.expect(1, 2).returns(3)
+
+
+@benchmark('mock.declare')
+def declare(count=20000):
+    """Build a mock of a large class with a few expectations, by hand."""
+    context = Context()
+    return _time_per_call(
+        lambda: _declare(Mock(LargeSubject, _context=context)), count
+    )
+
+
+@benchmark('mock.clone')
+def clone(count=20000):
+    """Build the same mock as ``mock.declare`` from a ``Prototype``."""
+    context = Context()
+    prototype = Prototype(LargeSubject)
+    _declare(prototype.mock)
+    return _time_per_call(lambda: prototype.clone(context), count)
+
+
+def call_with_expectations(size, count=20000, matcher=None):
+    """Time calls to a mocked method with `size` infinite expectations, which
+    only the last of them matches. `matcher`, if given, turns each expected
+    argument into a ``matches()`` argument.
+    """
+    context = Context()
+    mock = Mock(Subject, _context=context)
+    for n in range(size):
+        mock.foo.expect(matcher(n) if matcher else n).infinite_times()
+
+    foo = mock.foo
+    target = size - 1
+    return _time_per_call(lambda: foo(target), count)
+
+
+@benchmark('call.expectations.1')
+def call_1():
+    return call_with_expectations(1)
+
+
+@benchmark('call.expectations.100')
+def call_100():
+    return call_with_expectations(100)
+
+
+@benchmark('call.expectations.10000')
+def call_10000():
+    return call_with_expectations(10000)
+
+
+@benchmark('call.journal')
+def call_journal(count=20000):
+    context = Context()
+    context.enable_journal()
+    mock = Mock(Subject, _context=context)
+    mock.foo.expect(1).infinite_times()
+
+    return _time_per_call(lambda: mock.foo(1), count)
+
+
+@benchmark('call.matchers.100')
+def call_matchers_100():
+    return call_with_expectations(
+        100, count=2000, matcher=lambda n: matches(equal_to(n))
+    )
+
+
+@benchmark('call.mixed.100')
+def call_mixed_100(size=100, count=2000):
+    """Calls that scan `size` expectations of ``foo(<matcher>, n)``, of
+    which only the last one matches.
+    """
+    context = Context()
+    mock = Mock(Subject, _context=context)
+    for n in range(size):
+        mock.foo.expect(matches(anything()), n).infinite_times()
+
+    foo = mock.foo
+    target = size - 1
+    return _time_per_call(lambda: foo('x', target), count)
+
+
+@benchmark('declare.loop.10000')
+def declare_loop(size=10000):
+    """Seconds per expectation to declare a table of `size` of them one at a
+    time.
+    """
+    context = Context()
+    mock = Mock(Subject, _context=context)
+    rows = [((n,), None, n, 2) for n in range(size)]
+
+    start = _timer()
+    for args, kwargs, returns, times in rows:
+        mock.foo.expect(*args).returns(returns).times(times)
+    return (_timer() - start) / size
+
+
+@benchmark('declare.many.10000')
+def declare_many(size=10000):
+    """The same table as ``declare.loop.10000``, through ``expect_many()``."""
+    context = Context()
+    mock = Mock(Subject, _context=context)
+    rows = [((n,), None, n, 2) for n in range(size)]
+
+    start = _timer()
+    mock.foo.expect_many(rows)
+    return (_timer() - start) / size
+
+
+@benchmark('sequence.consume.10000')
+def sequence_10000(length=10000):
+    context = Context()
+    mock = Mock(Subject, _context=context)
+    s = Sequence()
+    for n in range(length):
+        mock.foo.expect(n).in_sequence(s)
+
+    foo = mock.foo
+    start = _timer()
+    for n in range(length):
+        foo(n)
+    return (_timer() - start) / length
+
+
+@benchmark('sequence.stream.10000')
+def sequence_stream(length=10000):
+    """``sequence.consume.10000``, with the steps streamed from a generator.
+    """
+    context = Context()
+    mock = Mock(Subject, _context=context)
+    foo = mock.foo
+    StreamingSequence((foo, (n,)) for n in range(length))
+
+    start = _timer()
+    for n in range(length):
+        foo(n)
+    return (_timer() - start) / length
+
+
+@benchmark('until_sums_to.10000')
+def until_sums_to(total=10000):
+    context = Context()
+    mock = Mock(Subject, _context=context)
+    mock.foo.expect(1).until_sums_to(total)
+
+    return _time_per_call(lambda: mock.foo(1), total)
+
+
+@benchmark('error.format.1000')
+def error_format(size=1000, count=20):
+    context = Context()
+    mocks = [Mock(Subject, _context=context) for x in range(10)]
+    for n in range(size):
+        mocks[n % len(mocks)].foo.expect(n)
+    call = Expectation(context, mocks[0].foo, ('unexpected',), {})
+
+    return _time_per_call(lambda: str(UnexpectedMethodCall(call)), count)
+
+
+@benchmark('memory.expectation', unit='bytes')
+def expectation_memory(count=100000):
+    """Return the number of bytes each live expectation of ``foo(n)`` costs,
+    counting everything it allocates: the expectation, its arguments and its
+    entry in the context's dispatch index.
+
+    Without ``tracemalloc`` (python 2) this falls back on the shallow size of
+    the expectation object alone.
+    """
+    context = Context()
+    mock = Mock(Subject, _context=context)
+    mock.foo
+
+    if tracemalloc is None:
+        return sys.getsizeof(mock.foo.expect(0))
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        expectations = [mock.foo.expect(n) for n in range(count)]
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    # The list holding the expectations isn't part of their cost.
+    return (after - before - sys.getsizeof(expectations)) / float(count)
+
+
+def thread_stress(num_threads=8, calls_per_thread=20000):
+    """Hammer a ``ThreadSafeContext`` from `num_threads` threads and return
+    the number of mocked calls per second.
+
+    Every thread calls its own mock and a mock shared by all of them, whose
+    expectation only allows exactly as many calls as they make in total.
+    Raises if a call fails or an expectation doesn't retire, because that
+    means the context lost count somewhere.
+    """
+    context = ThreadSafeContext()
+    shared = Mock(Subject, _context=context)
+    shared.foo.expect().times(num_threads * calls_per_thread)
+
+    errors = []
+
+    def worker(mock, n):
+        try:
+            for x in range(calls_per_thread):
+                shared.foo()
+                mock.foo(n)
+        except Exception as e:
+            errors.append(e)
+
+    threads = []
+    for n in range(num_threads):
+        mock = Mock(Subject, _context=context)
+        mock.foo.expect(n).times(calls_per_thread)
+        threads.append(threading.Thread(target=worker, args=(mock, n)))
+
+    start = _timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = _timer() - start
+
+    if errors:
+        raise errors[0]
+    context.assert_no_more_expectations()
+
+    return 2 * num_threads * calls_per_thread / elapsed
+
+
+@benchmark('threads.call')
+def thread_call():
+    return 1.0 / thread_stress(calls_per_thread=5000)
+
+
+def run(pattern=None, repeat=3):
+    """Run the benchmarks whose names contain `pattern` (all of them by
+    default), `repeat` times each, and return a dict mapping each name to
+    ``{'value': best cost, 'unit': unit}``.
+    """
+    results = collections.OrderedDict()
+    for name, (func, unit) in BENCHMARKS.items():
+        if pattern and pattern not in name:
+            continue
+
+        gc.collect()
+        results[name] = {'value': min(func() for x in range(repeat)),
+                         'unit': unit}
+
+    return results
+
+
+def format_value(value, unit):
+    if unit == 's':
+        return '%.3f us' % (value * 1e6)
+    return '%.0f %s' % (value, unit)
+
+
+def compare(old, new, threshold=0.1):
+    """Compare two sets of results and return a list of
+    ``(name, old value, new value, ratio, regressed)`` for the benchmarks in
+    both. A benchmark regressed if its ratio of new to old is more than
+    ``1 + threshold``.
+    """
+    rows = []
+    for name, result in new.items():
+        if name not in old:
+            continue
+        before = old[name]['value']
+        after = result['value']
+        ratio = after / before if before else float('inf')
+        rows.append((name, before, after, ratio, ratio > 1 + threshold))
+
+    return rows
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ditto.bench')
+    parser.add_argument('-k', dest='pattern', default=None,
+                        help='only run benchmarks whose name contains this')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per benchmark; the best one counts')
+    parser.add_argument('--json', dest='json_path', default=None,
+                        help='write the results to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two result files instead of running')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown ratio --compare tolerates')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        regressed = False
+        for name, before, after, ratio, worse in compare(
+                load(args.compare[0]), load(args.compare[1]), args.threshold):
+            regressed = regressed or worse
+            print('%-32s %6.2fx%s' % (name, ratio,
+                                      '  REGRESSED' if worse else ''))
+        return 1 if regressed else 0
+
+    results = run(args.pattern, args.repeat)
+    for name, result in results.items():
+        print('%-32s %s' % (name, format_value(result['value'],
+                                                  result['unit'])))
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'results': results}, f, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
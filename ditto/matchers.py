@@ -0,0 +1,158 @@
+# Copyright (C) 2010-2011 Cisco Systems, Inc
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# (1) Redistributions of source code must retain the above copyright notice,
+#     this list of conditions and the following disclaimer.
+#
+# (2) Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions and the following disclaimer in the documentation
+#     and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY CISCO SYSTEMS ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL CISCO SYSTEMS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are
+# those of the authors and should not be interpreted as representing official
+# policies, either expressed or implied, of Cisco Systems, Inc.
+
+"""\
+A few fast matchers that don't need hamcrest. Wrap them in ``matches()`` just
+like hamcrest matchers::
+
+    from ditto.matchers import anything, contains_string, predicate
+
+    my_instance.foo.expect(matches(anything()),
+                           matches(contains_string('foo')))
+    my_instance.bar.expect(matches(predicate(lambda x: x % 2, 'odd')))
+
+Each is a plain object with a ``matches(item)`` method and a description for
+``str()``, which is all ``matches()`` asks of a matcher.
+"""
+
+
+class Matcher(object):
+
+    """Base class of the native matchers. Subclasses define ``matches(item)``
+    and ``__str__``.
+    """
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return '<%s>' % self
+
+
+class IsAnything(Matcher):
+
+    __slots__ = ()
+
+    def matches(self, item):
+        return True
+
+    def __str__(self):
+        return 'ANYTHING'
+
+
+class IsInstanceOf(Matcher):
+
+    __slots__ = ('types',)
+
+    def __init__(self, types):
+        self.types = types
+
+    def matches(self, item):
+        return isinstance(item, self.types)
+
+    def __str__(self):
+        if isinstance(self.types, tuple):
+            names = ' or '.join(t.__name__ for t in self.types)
+        else:
+            names = self.types.__name__
+        return 'an instance of %s' % names
+
+
+class IsEqual(Matcher):
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def matches(self, item):
+        return self.value == item
+
+    def __str__(self):
+        return repr(self.value)
+
+
+class ContainsString(Matcher):
+
+    __slots__ = ('substring',)
+
+    def __init__(self, substring):
+        self.substring = substring
+
+    def matches(self, item):
+        return isinstance(item, type(self.substring)) and \
+               self.substring in item
+
+    def __str__(self):
+        return 'a string containing %r' % (self.substring,)
+
+
+class Predicate(Matcher):
+
+    __slots__ = ('func', 'description')
+
+    def __init__(self, func, description=None):
+        self.func = func
+        self.description = description
+
+    def matches(self, item):
+        return bool(self.func(item))
+
+    def __str__(self):
+        if self.description is not None:
+            return self.description
+        return 'a value satisfying %s' % getattr(self.func, '__name__',
+                                                 repr(self.func))
+
+
+_anything = IsAnything()
+
+
+def anything():
+    """Match any value at all."""
+    return _anything
+
+
+def instance_of(types):
+    """Match instances of `types`, a class or a tuple of classes."""
+    return IsInstanceOf(types)
+
+
+def equal_to(value):
+    """Match values that `value` is equal to."""
+    return IsEqual(value)
+
+
+def contains_string(substring):
+    """Match strings that contain `substring`."""
+    return ContainsString(substring)
+
+
+def predicate(func, description=None):
+    """Match values for which ``func(value)`` is true. `description` is what
+    the matcher says about itself in error messages.
+    """
+    return Predicate(func, description)
@@ -0,0 +1,66 @@
+# Copyright (C) 2010-2011 Cisco Systems, Inc
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# (1) Redistributions of source code must retain the above copyright notice,
+#     this list of conditions and the following disclaimer.
+#
+# (2) Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions and the following disclaimer in the documentation
+#     and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY CISCO SYSTEMS ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL CISCO SYSTEMS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are
+# those of the authors and should not be interpreted as representing official
+# policies, either expressed or implied, of Cisco Systems, Inc.
+
+"""\
+pytest plugin, registered automatically when ditto is installed.
+
+A test that asks for the ``ditto_context`` fixture runs in a fresh ``Context``,
+which mocks made during the test default to, and which has to have no
+required expectations left when the test is torn down. To give every test one,
+add this to your pytest configuration::
+
+    [pytest]
+    usefixtures = ditto_context
+
+The terminal summary reports the tests that left expectations unmet.
+"""
+
+import pytest
+
+from ditto import use_context
+from ditto.testing import leaks, verify
+
+
+@pytest.fixture
+def ditto_context(request):
+    with use_context() as context:
+        yield context
+        verify(context, request.node.nodeid)
+
+
+def pytest_sessionstart(session):
+    leaks.clear()
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not leaks.tests:
+        return
+
+    terminalreporter.section('ditto')
+    for test_name, count in leaks.tests.items():
+        terminalreporter.write_line('%s: %d unmet' % (test_name, count))
+    terminalreporter.write_line(leaks.summary())
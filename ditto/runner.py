@@ -0,0 +1,302 @@
+# Copyright (C) 2010-2011 Cisco Systems, Inc
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# (1) Redistributions of source code must retain the above copyright notice,
+#     this list of conditions and the following disclaimer.
+#
+# (2) Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions and the following disclaimer in the documentation
+#     and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY CISCO SYSTEMS ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL CISCO SYSTEMS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are
+# those of the authors and should not be interpreted as representing official
+# policies, either expressed or implied, of Cisco Systems, Inc.
+
+"""\
+Runs ``unittest`` suites across a pool of worker processes::
+
+    python -m ditto.runner -j 8 ditto.test_ditto
+
+The tests named on the command line (anything ``unittest`` can load by name)
+are split into shards, which the workers pick up as they go. Each worker resets
+``default_context`` before every test, so expectations never leak from one test
+into the next, or from the parent into a worker.
+
+Failures come back to the parent as ``Failure`` records, which are plain tuples
+of strings so that they can be pickled. For ``UnmetExpectations`` and
+``UnexpectedMethodCall`` they also carry the expectations involved, as
+``ExpectationRecord`` tuples.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import multiprocessing
+import sys
+import time
+import traceback
+import unittest
+
+from ditto import (MockError, UnexpectedMethodCall, UnmetExpectations,
+                   default_context)
+
+
+Failure = collections.namedtuple('Failure', [
+    'test_id',       # The ``unittest`` id of the test.
+    'outcome',       # 'failure' or 'error'.
+    'exc_type',      # The exception's class name, e.g. 'UnmetExpectations'.
+    'message',       # ``str()`` of the exception.
+    'call',          # The unexpected call, for ``UnexpectedMethodCall``.
+    'expectations',  # The unmet (or active, for ``UnexpectedMethodCall``)
+                     # expectations, for mock errors. Otherwise empty.
+    'traceback',     # The formatted traceback.
+])
+
+ExpectationRecord = collections.namedtuple('ExpectationRecord', [
+    'mock',          # The mocked class or module, as 'module.name'.
+    'method',        # The mocked method's name.
+    'arguments',     # The expected arguments, formatted as in mock errors.
+])
+
+ShardResult = collections.namedtuple('ShardResult', [
+    'tests_run', 'skipped', 'failures',
+])
+
+
+class Report(object):
+
+    """What the workers found, all added up.
+
+    :Attributes:
+        - `tests_run`: How many tests ran.
+        - `skipped`: How many tests were skipped.
+        - `failures`: The list of ``Failure`` records, in the order the tests
+          were sharded.
+        - `elapsed`: The wall-clock time the run took, in seconds.
+    """
+
+    def __init__(self, tests_run=0, skipped=0, failures=None, elapsed=0.0):
+        self.tests_run = tests_run
+        self.skipped = skipped
+        self.failures = failures or []
+        self.elapsed = elapsed
+
+    def add(self, shard_result):
+        self.tests_run += shard_result.tests_run
+        self.skipped += shard_result.skipped
+        self.failures.extend(shard_result.failures)
+
+    def was_successful(self):
+        return not self.failures
+
+
+def describe_mock(mocked):
+    if mocked is None:
+        return None
+
+    module = getattr(mocked, '__module__', None)
+    name = getattr(mocked, '__name__', repr(mocked))
+
+    return '%s.%s' % (module, name) if module else name
+
+
+def expectation_record(error, expectation):
+    mock = expectation.method.mock
+
+    return ExpectationRecord(
+        mock=describe_mock(mock and mock._mocked_cls),
+        method=expectation.method.name,
+        arguments=error.format_arguments(expectation),
+    )
+
+
+def failure_record(test_id, outcome, exc_info):
+    exc_type, error, tb = exc_info
+
+    call = None
+    expectations = ()
+    if isinstance(error, UnexpectedMethodCall):
+        call = expectation_record(error, error.call)
+        expectations = error.active
+    elif isinstance(error, UnmetExpectations):
+        expectations = error.required
+
+    if isinstance(error, MockError):
+        expectations = tuple(expectation_record(error, e)
+                             for e in expectations)
+
+    return Failure(
+        test_id=test_id,
+        outcome=outcome,
+        exc_type=exc_type.__name__,
+        message=str(error),
+        call=call,
+        expectations=expectations,
+        traceback=''.join(traceback.format_exception(exc_type, error, tb)),
+    )
+
+
+class _RecordingResult(unittest.TestResult):
+
+    """Turns the outcome of each test into a ``Failure`` record on the spot,
+    while the exception can still be looked at.
+    """
+
+    def __init__(self):
+        super(_RecordingResult, self).__init__()
+        self.records = []
+
+    def startTest(self, test):
+        default_context.retire_all_expectations()
+        super(_RecordingResult, self).startTest(test)
+
+    def addFailure(self, test, err):
+        self.records.append(failure_record(test.id(), 'failure', err))
+
+    def addError(self, test, err):
+        self.records.append(failure_record(test.id(), 'error', err))
+
+    def addSubTest(self, test, subtest, err):
+        if err is not None:
+            outcome = 'failure' if issubclass(err[0], test.failureException) \
+                else 'error'
+            self.records.append(failure_record(subtest.id(), outcome, err))
+
+    def addUnexpectedSuccess(self, test):
+        self.records.append(Failure(test.id(), 'failure', None,
+                                    'unexpected success', None, (), ''))
+
+
+def iter_tests(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            for t in iter_tests(test):
+                yield t
+        else:
+            yield test
+
+
+def collect(names):
+    """Return the ids of all the tests in `names`, which are anything
+    ``unittest`` can load by name.
+    """
+    loader = unittest.defaultTestLoader
+    return [test.id()
+            for test in iter_tests(loader.loadTestsFromNames(names))]
+
+
+def run_shard(test_ids):
+    """Run the tests with the given ids in this process, and return a
+    ``ShardResult``.
+    """
+    loader = unittest.defaultTestLoader
+    result = _RecordingResult()
+    loader.loadTestsFromNames(test_ids)(result)
+
+    return ShardResult(result.testsRun, len(result.skipped), result.records)
+
+
+def shard(test_ids, count):
+    """Split `test_ids` into at most `count` contiguous shards of about the
+    same size. Contiguous, so that tests which share a module or fixture tend
+    to end up in the same worker.
+    """
+    count = max(1, min(count, len(test_ids)))
+    size, extra = divmod(len(test_ids), count)
+
+    shards = []
+    start = 0
+    for n in range(count):
+        end = start + size + (n < extra)
+        shards.append(test_ids[start:end])
+        start = end
+
+    return [x for x in shards if x]
+
+
+def run(names, processes=None, shards_per_process=4):
+    """Run the tests in `names` across `processes` worker processes (by
+    default, one per CPU) and return a ``Report``.
+
+    Each worker gets `shards_per_process` shards on average. More, smaller
+    shards balance uneven tests better; fewer cost less in overhead.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    start = time.time()
+
+    test_ids = collect(names)
+    report = Report()
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap(run_shard,
+                                shard(test_ids,
+                                      processes * shards_per_process)):
+            report.add(result)
+    finally:
+        pool.close()
+        pool.join()
+
+    report.elapsed = time.time() - start
+
+    return report
+
+
+def print_report(report, stream=sys.stderr):
+    separator = '-' * 70
+
+    for failure in report.failures:
+        print('=' * 70, file=stream)
+        print('%s: %s' % (failure.outcome.upper(), failure.test_id),
+              file=stream)
+        print(separator, file=stream)
+        print(failure.traceback or failure.message, file=stream)
+
+    print(separator, file=stream)
+    print('Ran %d tests in %.3fs' % (report.tests_run, report.elapsed),
+          file=stream)
+    print(file=stream)
+
+    counts = collections.Counter(x.outcome for x in report.failures)
+    details = ['%ss=%d' % (outcome, counts[outcome])
+               for outcome in ('failure', 'error') if counts[outcome]]
+    if report.skipped:
+        details.append('skipped=%d' % report.skipped)
+
+    status = 'OK' if report.was_successful() else 'FAILED'
+    if details:
+        status += ' (%s)' % ', '.join(details)
+    print(status, file=stream)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ditto.runner')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='number of worker processes (default: one per '
+                             'CPU)')
+    parser.add_argument('names', nargs='+', metavar='name',
+                        help='a test module, class or method to run')
+    args = parser.parse_args(argv)
+
+    report = run(args.names, args.processes)
+    print_report(report)
+
+    return 0 if report.was_successful() else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
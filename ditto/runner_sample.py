@@ -0,0 +1,31 @@
+# A tiny suite for the tests of ``ditto.runner`` to run: one test passes, one
+# fails and one leaves an expectation unmet.
+
+import unittest
+
+from ditto import Mock, default_context
+
+
+class Thing(object):
+
+    def bar(self, x):
+        raise NotImplementedError
+
+
+# Verification happens in the test bodies rather than in tearDown, because
+# python 2.7 reports anything raised by tearDown as an error, and 3 as a
+# failure.
+class Sample(unittest.TestCase):
+
+    def test_passes(self):
+        thing = Mock(Thing)
+        thing.bar.expect(1)
+        thing.bar(1)
+        default_context.assert_no_more_expectations()
+
+    def test_fails(self):
+        self.assertEqual(1, 2)
+
+    def test_unmet(self):
+        Mock(Thing).bar.expect(2)
+        default_context.assert_no_more_expectations()
@@ -0,0 +1,226 @@
+# Copyright (C) 2010-2011 Cisco Systems, Inc
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# (1) Redistributions of source code must retain the above copyright notice,
+#     this list of conditions and the following disclaimer.
+#
+# (2) Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions and the following disclaimer in the documentation
+#     and/or other materials provided with the distribution.  
+#
+# THIS SOFTWARE IS PROVIDED BY CISCO SYSTEMS ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL CISCO SYSTEMS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are
+# those of the authors and should not be interpreted as representing official
+# policies, either expressed or implied, of Cisco Systems, Inc.
+
+
+# Tests for ``ditto.aio``. They need ``async def``, so unlike test_ditto this
+# module only runs on python 3.5 and later.
+
+import asyncio
+import inspect
+import unittest
+
+from ditto import (Context, Mock, MockMethod, Sequence, UnexpectedMethodCall,
+                   UnmetExpectations, current_context, use_context)
+from ditto import testing
+from ditto.aio import AsyncMockMethod
+
+
+class AsyncThingToMock(object):
+
+    async def fetch(self, key):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    async def __aenter__(self):
+        raise NotImplementedError
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        raise NotImplementedError
+
+    def __aiter__(self):
+        raise NotImplementedError
+
+    async def __anext__(self):
+        raise NotImplementedError
+
+
+class AsyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scope = use_context()
+        self.context = self.scope.__enter__()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.mock = Mock(AsyncThingToMock)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+        self.scope.__exit__(None, None, None)
+
+    def run_until_complete(self, awaitable):
+        return self.loop.run_until_complete(awaitable)
+
+
+class AwaitableMethods(AsyncTest):
+
+    def runTest(self):
+        self.assertTrue(isinstance(self.mock.fetch, AsyncMockMethod))
+        self.assertFalse(isinstance(self.mock.close, AsyncMockMethod))
+        self.assertTrue(isinstance(self.mock.close, MockMethod))
+
+        self.mock.fetch.expect('a').returns(1)
+        self.mock.fetch.expect('b').raises(KeyError('b'))
+
+        self.assertEqual(1, self.run_until_complete(self.mock.fetch('a')))
+        self.assertRaises(KeyError, self.run_until_complete,
+                          self.mock.fetch('b'))
+
+        # Unexpected calls fail when they're made, not when they're awaited.
+        self.assertRaises(UnexpectedMethodCall, self.mock.fetch, 'c')
+        self.context.assert_no_more_expectations()
+
+
+class Delays(AsyncTest):
+
+    def runTest(self):
+        self.mock.fetch.expect('slow').returns('slow').delays(0.05)
+        self.mock.fetch.expect('fast').returns('fast')
+
+        finished = []
+        async def fetch(key):
+            finished.append(await self.mock.fetch(key))
+
+        start = self.loop.time()
+        self.run_until_complete(asyncio.gather(fetch('slow'), fetch('fast')))
+
+        self.assertEqual(['fast', 'slow'], finished)
+        self.assertTrue(self.loop.time() - start >= 0.05)
+
+
+class AsyncProtocols(AsyncTest):
+
+    def runTest(self):
+        self.mock.__aenter__.expect().returns(self.mock)
+        self.mock.__aexit__.expect(None, None, None)
+        self.mock.__aiter__.expect().returns(self.mock)
+        self.mock.__anext__.expect().returns(1)
+        self.mock.__anext__.expect().returns(2)
+        self.mock.__anext__.expect().raises(StopAsyncIteration)
+
+        async def consume():
+            async with self.mock as mock:
+                return [x async for x in mock]
+
+        self.assertEqual([1, 2], self.run_until_complete(consume()))
+        self.context.assert_no_more_expectations()
+
+
+class ConcurrentSequence(AsyncTest):
+
+    def runTest(self):
+        num_tasks = 1000
+
+        s = Sequence()
+        for n in range(num_tasks):
+            self.mock.fetch.expect(n).returns(n).delays(
+                0.02 if n == 0 else 0
+            ).in_sequence(s)
+
+        # The tasks make their calls in order, then all wait at once, so the
+        # first one to call finishes last.
+        finished = []
+        async def fetch(n):
+            finished.append(await self.mock.fetch(n))
+
+        self.run_until_complete(
+            asyncio.gather(*[fetch(n) for n in range(num_tasks)])
+        )
+
+        self.assertEqual(list(range(num_tasks)), sorted(finished))
+        self.assertEqual(0, finished[-1])
+        self.context.assert_no_more_expectations()
+
+
+class SharedScope(AsyncTest):
+
+    def runTest(self):
+        context = Context()
+        scope = use_context(context)
+        seen = []
+
+        # The first task to enter the scope is the first to leave it, while
+        # the other is still inside.
+        async def task(delay):
+            with scope:
+                await asyncio.sleep(delay)
+                seen.append(current_context())
+            seen.append(current_context())
+
+        self.run_until_complete(asyncio.gather(task(0.01), task(0.02)))
+        self.assertEqual([context, self.context] * 2, seen)
+
+
+class ScopedCoroutineFunction(AsyncTest):
+
+    def runTest(self):
+        contexts = []
+
+        @use_context()
+        async def scoped():
+            await asyncio.sleep(0)
+            mock = Mock(AsyncThingToMock)
+            contexts.append(mock._context)
+            self.assertTrue(current_context() is mock._context)
+
+        self.assertTrue(inspect.iscoroutinefunction(scoped))
+        self.run_until_complete(asyncio.gather(scoped(), scoped()))
+        self.assertEqual(2, len(set(map(id, contexts))))
+        self.assertFalse(self.context in contexts)
+        self.assertTrue(current_context() is self.context)
+
+
+class VerifiedCoroutineFunction(AsyncTest):
+
+    def runTest(self):
+        testing.leaks.clear()
+
+        @testing.verify_expectations
+        async def met():
+            mock = Mock(AsyncThingToMock)
+            mock.fetch.expect('a')
+            await asyncio.sleep(0)
+            await mock.fetch('a')
+
+        @testing.verify_expectations
+        async def unmet():
+            await asyncio.sleep(0)
+            Mock(AsyncThingToMock).fetch.expect('a')
+
+        self.run_until_complete(met())
+        self.assertRaises(UnmetExpectations, self.run_until_complete,
+                          unmet())
+        self.assertEqual(['unmet'], list(testing.leaks.tests))
+        self.assertEqual(1, testing.leaks.total)
+        self.assertEqual((), self.context.expectations)
+        testing.leaks.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -26,14 +26,28 @@
 # policies, either expressed or implied, of Cisco Systems, Inc.
 
 
+import copy
+import gc
 import hamcrest
+import multiprocessing
+import pickle
+import sys
+import threading
 import unittest
+import weakref
 
-from ditto import (Mock, Expectation, Sequence, default_context,
+try:
+    from unittest.mock import patch
+except ImportError:
+    patch = None
+
+from ditto import (Mock, Context, Expectation, Sequence, default_context,
                    UnmetExpectations, UnexpectedMethodCall, matches, Sum,
-                   UnequalSumArguments)
+                   UnequalSumArguments, ThreadSafeContext, use_context,
+                   current_context, MockError, Prototype, StreamingSequence,
+                   MockMethod, forget_method_plan)
 
-import test_module
+from ditto import bench, matchers, runner, test_module, testing
 
 
 # This excpetion is defined so that it's easy to detect when we neglect to mock
@@ -100,6 +114,8 @@ class ExpectationList(MockTest):
 
         self.assert_(newexp in default_context.expectations)
         self.assert_(newexp2 in default_context.expectations)
+        self.assertRaises(AttributeError, getattr,
+                          default_context.expectations, 'remove')
 
         self.mock_of_thing.baz()
         self.assertEquals(1, len(default_context.expectations))
@@ -507,5 +523,989 @@ class BothArgs(SumTest):
                        'newcrazyarg': 1}),
     ] 
 
+
+class DeclarationOrder(Validate):
+
+    def runTest(self):
+        # Expectations on other mocks and methods shouldn't get in the way.
+        for x in range(100):
+            self.other_mock_of_thing.bar.expect(x).optional()
+            self.mock_of_other_thing.foo.expect(x).optional()
+
+        self.mock_of_thing.bar.expect(1).returns('first')
+        self.mock_of_thing.bar.expect(matches(hamcrest.anything())) \
+            .returns('second')
+        self.mock_of_thing.bar.expect(1).returns('third')
+
+        self.assertEquals('first', self.mock_of_thing.bar(1))
+        self.assertEquals('second', self.mock_of_thing.bar(1))
+        self.assertEquals('third', self.mock_of_thing.bar(1))
+
+
+class SequenceHeadsFirst(Validate):
+
+    def runTest(self):
+        s1 = Sequence()
+        s2 = Sequence()
+        self.mock_of_thing.baz.expect(1).in_sequence(s1)
+        self.mock_of_thing.bar.expect(2).returns('s1').in_sequence(s1)
+        self.mock_of_thing.bar.expect(1).returns('s2').in_sequence(s2)
+        self.mock_of_thing.bar.expect(1).returns('free')
+        self.mock_of_thing.bar.expect(2).returns('free')
+
+        # s1's head is on baz, so s2's head is the only head for bar.
+        self.assertEquals('s2', self.mock_of_thing.bar(1))
+        self.assertEquals('free', self.mock_of_thing.bar(1))
+        self.mock_of_thing.baz(1)
+        self.assertEquals('s1', self.mock_of_thing.bar(2))
+        self.assertEquals('free', self.mock_of_thing.bar(2))
+
+
+class ExactArguments(Validate):
+
+    def runTest(self):
+        class EqualsEverything(object):
+            def __eq__(self, other):
+                return True
+
+        self.mock_of_thing.bar.expect(1, ('a', 2.5), key=None).returns('tuple')
+        self.mock_of_thing.bar.expect([1]).returns('list')
+        self.mock_of_thing.bar.expect(3).returns('three')
+
+        self.assertRaises(UnexpectedMethodCall,
+                          self.mock_of_thing.bar, 1, ('a', 2.5))
+        self.assertEquals('list', self.mock_of_thing.bar([1]))
+        self.assertEquals('tuple',
+                          self.mock_of_thing.bar(1.0, ('a', 2.5), key=None))
+
+        # Calls that can't be hashed still have to find exact expectations.
+        self.assertEquals('three', self.mock_of_thing.bar(EqualsEverything()))
+
+
+class SequenceSkipsRetired(Validate):
+
+    def runTest(self):
+        s1 = Sequence()
+        s2 = Sequence()
+        self.mock_of_thing.bar.expect('a').in_sequence(s1)
+        self.mock_of_thing.bar.expect('b').in_sequence(s1).in_sequence(s2)
+        self.mock_of_thing.bar.expect('c').in_sequence(s1)
+        self.mock_of_thing.baz.expect('d').in_sequence(s2)
+
+        # 'b' is at the head of s2, so it can go first. That retires it from
+        # the middle of s1 too.
+        self.mock_of_thing.bar('b')
+        self.mock_of_thing.baz('d')
+        self.assertRaises(UnexpectedMethodCall, self.mock_of_thing.bar, 'c')
+        self.mock_of_thing.bar('a')
+        self.assertRaises(UnexpectedMethodCall, self.mock_of_thing.bar, 'b')
+        self.mock_of_thing.bar('c')
+
+        self.assertEquals((), default_context.sequences)
+
+
+class LongSequence(Validate):
+
+    def runTest(self):
+        s = Sequence()
+        num_steps = 10000
+        for x in range(num_steps):
+            self.mock_of_thing.bar.expect(x).returns(x).in_sequence(s)
+
+        for x in range(num_steps):
+            self.assertEquals(x, self.mock_of_thing.bar(x))
+
+
+class IdentityBookkeeping(Validate):
+
+    def runTest(self):
+        class ExplodingMatcher(object):
+            def matches(self, other):
+                raise MockTestExcpetion
+
+        self.mock_of_thing.baz.expect(matches(ExplodingMatcher())).optional()
+        self.mock_of_thing.bar.expect(1).returns('free')
+        self.mock_of_thing.bar.expect(1).returns('seq').in_sequence(Sequence())
+
+        # Putting the second expectation in a sequence mustn't take the first,
+        # equal-looking one out of the context, nor run anybody's matchers.
+        self.assertEquals('seq', self.mock_of_thing.bar(1))
+        self.assertEquals('free', self.mock_of_thing.bar(1))
+
+
+class MethodPlanCache(unittest.TestCase):
+
+    def runTest(self):
+        class Mutable(object):
+            def bar(self):
+                raise MockTestExcpetion
+
+        calls = []
+        def method_selector(cls, method_name):
+            calls.append(method_name)
+            return (method_name in ('bar', 'baz') and
+                    callable(getattr(cls, method_name)))
+
+        Mock(Mutable, _method_selector=method_selector)
+        num_calls = len(calls)
+        self.assert_(num_calls)
+
+        m = Mock(Mutable, _method_selector=method_selector)
+        self.assertEquals(num_calls, len(calls))
+        self.assert_(not hasattr(m, 'baz'))
+
+        # Changing the class throws the cached plan away.
+        Mutable.baz = lambda self: None
+        m = Mock(Mutable, _method_selector=method_selector)
+        self.assert_(len(calls) > num_calls)
+        self.assert_(hasattr(m, 'baz'))
+
+        # Rebinding an attribute, here or in a base class, takes
+        # forget_method_plan(), whichever way it goes.
+        Mutable.baz = None
+        m = Mock(Mutable, _method_selector=method_selector)
+        self.assertTrue(hasattr(m, 'baz'))
+        forget_method_plan(Mutable)
+        m = Mock(Mutable, _method_selector=method_selector)
+        self.assertTrue(not hasattr(m, 'baz'))
+
+        if patch is not None:
+            with patch.object(Mutable, 'bar', 5):
+                forget_method_plan()
+                m = Mock(Mutable, _method_selector=method_selector)
+                self.assertTrue(not hasattr(m, 'bar'))
+            with patch.object(Mutable, 'baz', lambda self: 7):
+                forget_method_plan()
+                m = Mock(Mutable, _method_selector=method_selector)
+                self.assertTrue(isinstance(m.baz, MockMethod))
+                self.assertTrue(isinstance(m.bar, MockMethod))
+
+            forget_method_plan()
+            m = Mock(Mutable, _method_selector=method_selector)
+            self.assertTrue(isinstance(m.bar, MockMethod))
+            self.assertTrue(not hasattr(m, 'baz'))
+
+        class Child(Mutable):
+            pass
+
+        m = Mock(Child, _method_selector=method_selector)
+        self.assertTrue(isinstance(m.bar, MockMethod))
+        Mutable.bar = 5
+        forget_method_plan()
+        m = Mock(Child, _method_selector=method_selector)
+        self.assertTrue(not hasattr(m, 'bar'))
+
+        # The cache doesn't keep a selector, or what it made, alive.
+        generated = weakref.ref(type(m))
+        method_selector = weakref.ref(method_selector)
+        del m
+        gc.collect()
+        self.assertTrue(method_selector() is None)
+        self.assertTrue(generated() is None)
+
+
+class LazyMethods(Validate):
+
+    def runTest(self):
+        def created(mock, name):
+            # object.__getattribute__ never falls back on Mock.__getattr__.
+            try:
+                object.__getattribute__(mock, name)
+            except AttributeError:
+                return False
+            return True
+
+        self.assert_(not created(self.mock_of_thing, 'bar'))
+        self.assert_(self.mock_of_thing.bar is self.mock_of_thing.bar)
+        self.assert_(created(self.mock_of_thing, 'bar'))
+        self.assert_(not created(self.mock_of_thing, 'baz'))
+        self.assertRaises(AttributeError, getattr, self.mock_of_thing, 'foo')
+
+        eager = Mock(ThingToMock, _lazy=False)
+        self.assert_(created(eager, 'bar') and created(eager, 'baz'))
+
+
+class GeneratedMockClass(Validate):
+
+    def runTest(self):
+        class Resource(object):
+            def __enter__(self):
+                raise MockTestExcpetion
+            def __exit__(self, *exc_info):
+                raise MockTestExcpetion
+            def read(self):
+                raise MockTestExcpetion
+
+        def method_selector(cls, method_name):
+            return method_name in ('__enter__', '__exit__', 'read')
+
+        m = Mock(Resource, _method_selector=method_selector)
+        self.assert_(isinstance(m, Mock))
+        self.assertEquals('Mock[Resource]', type(m).__name__)
+        self.assert_(type(m) is type(Mock(Resource,
+                                          _method_selector=method_selector)))
+        self.assert_(type(m) is not type(self.mock_of_thing))
+        self.assertEquals(('read',), type(m).__slots__)
+
+        m.__enter__.expect().returns('resource')
+        m.read.expect().returns('data')
+        m.__exit__.expect(None, None, None)
+
+        with m as resource:
+            self.assertEquals('resource', resource)
+            self.assertEquals('data', m.read())
+
+        # Other mocked classes don't grow protocol methods.
+        self.assert_(not hasattr(self.mock_of_thing, '__enter__'))
+
+        # Keyword arguments still end up on the mock.
+        self.assertEquals(5, Mock(Resource, size=5).size)
+
+
+class CopiesAndSubclasses(unittest.TestCase):
+
+    def runTest(self):
+        context = Context()
+
+        class ThingMock(Mock):
+            def __init__(self, value):
+                Mock.__init__(self, ThingToMock, _context=context)
+                self.value = value
+
+        m = ThingMock(7)
+        self.assertTrue(type(m) is ThingMock)
+        self.assertTrue(not hasattr(m, 'bit_length'))
+        m.bar.expect().returns(1)
+        self.assertEquals(1, m.bar())
+
+        m = Mock(ThingToMock, _context=context, size=5)
+        m.bar.expect().returns(2)
+        shallow = copy.copy(m)
+        self.assertTrue(type(shallow) is type(m))
+        self.assertTrue(shallow.bar is m.bar)
+        self.assertEquals(5, shallow.size)
+        self.assertEquals(2, shallow.bar())
+
+        deep = copy.deepcopy(m)
+        self.assertTrue(type(deep) is type(m))
+        self.assertTrue(deep.bar.mock is deep)
+
+        shallow = copy.copy(ThingMock(8))
+        self.assertEquals((ThingMock, 8), (type(shallow), shallow.value))
+
+
+class CompactRepresentation(Validate):
+
+    def runTest(self):
+        s = Sequence()
+        e = self.mock_of_thing.bar.expect(1).returns(2).times(2).optional() \
+                .in_sequence(s)
+
+        for obj in (e, e.method, s, Sum((1,), {})):
+            self.assertRaises(AttributeError, setattr, obj, 'extra', None)
+
+        self.assertEquals(2, self.mock_of_thing.bar(1))
+
+
+class NoThrowawayExpectations(Validate):
+
+    def runTest(self):
+        self.mock_of_thing.bar.expect(1).returns('one')
+        self.mock_of_thing.bar.expect(matches(matchers.instance_of(str))) \
+            .returns('str')
+        s = Sequence()
+        self.mock_of_thing.baz.expect(2, two=2).returns('seq').in_sequence(s)
+
+        created = []
+        init = Expectation.__init__
+        def counting_init(self, *args, **kwargs):
+            created.append(args)
+            init(self, *args, **kwargs)
+
+        Expectation.__init__ = counting_init
+        try:
+            # Calls are matched against the expectations as they are.
+            self.assertEquals('str', self.mock_of_thing.bar('x'))
+            self.assertEquals('one', self.mock_of_thing.bar(1))
+            self.assertEquals('seq', self.mock_of_thing.baz(2, two=2))
+            self.assertEquals([], created)
+
+            # Only an unexpected call builds one, to describe itself.
+            self.assertRaises(UnexpectedMethodCall, self.mock_of_thing.bar, 3)
+            self.assertEquals(1, len(created))
+            self.assertEquals((3,), created[0][2])
+        finally:
+            Expectation.__init__ = init
+
+
+class DeferredErrorMessages(Validate):
+
+    def runTest(self):
+        formatted = []
+
+        class CountingMatcher(object):
+            def matches(self, other):
+                return False
+            def __str__(self):
+                formatted.append(self)
+                return 'counting'
+
+        matchers = [CountingMatcher() for x in range(3)]
+        for matcher in matchers:
+            self.mock_of_thing.bar.expect(matches(matcher)).optional()
+
+        try:
+            self.mock_of_thing.bar(1)
+        except UnexpectedMethodCall as e:
+            error = e
+        self.assertEquals([], formatted)
+
+        error.max_expectations = 2
+        message = str(error)
+        self.assert_('... and 1 more expectations' in message)
+        self.assertEquals(2, len(formatted))
+        self.assert_(message is str(error))
+        self.assertEquals((message,), error.args)
+        self.assertEquals('UnexpectedMethodCall(%r)' % message, repr(error))
+
+        # The expectations listed are the first ones declared, even though
+        # a context keeps the heads of sequences apart from the rest.
+        self.assertEqual(set(map(id, matchers[:2])), set(map(id, formatted)))
+
+        context = Context()
+        mock = Mock(ThingToMock, _context=context)
+        mock.bar.expect('first')
+        mock.baz.expect('second').in_sequence(Sequence())
+        unmet = UnmetExpectations(context)
+        unmet.max_expectations = 1
+        self.assertTrue("bar('first')" in str(unmet))
+        self.assertTrue('second' not in str(unmet))
+
+        for error in (error, unmet):
+            message = str(error)
+            copied = pickle.loads(pickle.dumps(error))
+            self.assertTrue(type(copied) is type(error))
+            self.assertEqual(message, str(copied))
+            self.assertEqual((message,), copied.args)
+
+
+class ThreadedCalls(unittest.TestCase):
+
+    def runTest(self):
+        context = ThreadSafeContext()
+        num_threads = 4
+        num_calls = 500
+
+        shared = Mock(ThingToMock, _context=context)
+        shared.bar.expect().times(num_threads * num_calls)
+
+        s = Sequence()
+        shared.baz.expect(1).in_sequence(s)
+        shared.baz.expect(2).in_sequence(s)
+
+        errors = []
+        def worker(mock):
+            try:
+                for x in range(num_calls):
+                    shared.bar()
+                    mock.bar(x)
+            except Exception as e:
+                errors.append(e)
+
+        threads = []
+        for n in range(num_threads):
+            mock = Mock(ThingToMock, _context=context)
+            for x in range(num_calls):
+                mock.bar.expect(x)
+            threads.append(threading.Thread(target=worker, args=(mock,)))
+
+        for thread in threads:
+            thread.start()
+        shared.baz(1)
+        shared.baz(2)
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals([], errors)
+        context.assert_no_more_expectations()
+        self.assertRaises(UnexpectedMethodCall, shared.bar)
+
+        # A call that only took its stripe, because its method didn't head a
+        # sequence yet, backs off rather than retire a sequence head.
+        s = Sequence()
+        shared.bar.expect().in_sequence(s)
+        context._match_and_call(shared.bar, (), {}, False)
+        self.assertEquals((s,), context.sequences)
+        shared.bar()
+        context.assert_no_more_expectations()
+
+
+class ScopedContext(unittest.TestCase):
+
+    def runTest(self):
+        unscoped = default_context.expectations
+
+        with use_context() as context:
+            self.assertTrue(current_context() is context)
+            mock = Mock(ThingToMock)
+            mock.bar.expect(1)
+            self.assertTrue(mock._context is context)
+            self.assertEquals(unscoped, default_context.expectations)
+            self.assertRaises(UnmetExpectations,
+                              context.assert_no_more_expectations)
+            mock.bar(1)
+
+        self.assertTrue(current_context() is default_context)
+
+        contexts = []
+        @use_context()
+        def scoped():
+            contexts.append(current_context())
+        scoped()
+        scoped()
+        self.assertFalse(contexts[0] is contexts[1])
+        self.assertFalse(default_context in contexts)
+
+        # Each thread gets its own scope, even when they share a use_context.
+        errors = []
+        shared = use_context()
+        def worker(x):
+            try:
+                with shared as context:
+                    mock = Mock(ThingToMock)
+                    mock.bar.expect(x)
+                    for n in range(100):
+                        self.assertTrue(current_context() is context)
+                    mock.bar(x)
+                    context.assert_no_more_expectations()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(x,))
+                   for x in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals([], errors)
+        self.assertEquals(unscoped, default_context.expectations)
+
+
+class ShardedRunner(unittest.TestCase):
+
+    def runTest(self):
+        self.assertEquals([[1, 2, 3], [4, 5], [6, 7]],
+                          runner.shard([1, 2, 3, 4, 5, 6, 7], 3))
+        self.assertEquals([[1], [2]], runner.shard([1, 2], 5))
+
+        ids = runner.collect(['ditto.runner_sample'])
+        self.assertEqual(['ditto.runner_sample.Sample.test_' + x
+                          for x in ('fails', 'passes', 'unmet')], ids)
+        self.check_sample(runner.run_shard(ids))
+
+        # The workers are daemonic, so they can't start pools of their own
+        # when this suite is the one being run.
+        if not multiprocessing.current_process().daemon:
+            report = runner.run(['ditto.runner_sample'], processes=2)
+            self.assertFalse(report.was_successful())
+            self.check_sample(report)
+
+        context = Context()
+        mock = Mock(ThingToMock, _context=context)
+        mock.bar.expect(1, two=2)
+        try:
+            context.assert_no_more_expectations()
+        except UnmetExpectations:
+            record = runner.failure_record('some.test', 'failure',
+                                           sys.exc_info())
+
+        record = pickle.loads(pickle.dumps(record))
+        self.assertEquals('UnmetExpectations', record.exc_type)
+        self.assertEquals(None, record.call)
+        self.assertEquals((runner.ExpectationRecord(
+            'ditto.test_ditto.ThingToMock', 'bar', '1, two=2'
+        ),), record.expectations)
+
+        try:
+            mock.baz(3)
+        except UnexpectedMethodCall:
+            record = runner.failure_record('some.test', 'failure',
+                                           sys.exc_info())
+
+        self.assertEquals('baz', record.call.method)
+        self.assertEquals('3', record.call.arguments)
+        self.assertEquals(['bar'], [x.method for x in record.expectations])
+
+        if hasattr(unittest.TestCase, 'subTest'):
+            self.check_subtests()
+
+    def check_sample(self, result):
+        self.assertEqual(3, result.tests_run)
+        self.assertEqual(0, result.skipped)
+
+        fails, unmet = result.failures
+        self.assertEqual(('ditto.runner_sample.Sample.test_fails', 'failure',
+                          'AssertionError', None, ()),
+                         (fails.test_id, fails.outcome, fails.exc_type,
+                          fails.call, fails.expectations))
+        self.assertEqual(('ditto.runner_sample.Sample.test_unmet', 'failure',
+                          'UnmetExpectations', None),
+                         (unmet.test_id, unmet.outcome, unmet.exc_type,
+                          unmet.call))
+        self.assertEqual((runner.ExpectationRecord(
+            'ditto.runner_sample.Thing', 'bar', '2'
+        ),), unmet.expectations)
+
+    def check_subtests(self):
+        class Subtests(unittest.TestCase):
+            def runTest(self):
+                for n in range(3):
+                    with self.subTest(n=n):
+                        self.assertEqual(0, n)
+
+        result = runner._RecordingResult()
+        Subtests().run(result)
+        self.assertEquals(['failure', 'failure'],
+                          [x.outcome for x in result.records])
+        self.assertTrue(result.records[0].test_id.endswith('(n=1)'))
+
+
+class PerTestContexts(unittest.TestCase):
+
+    def runTest(self):
+        class Tests(testing.ContextMixin, unittest.TestCase):
+            def test_met(self):
+                mock = Mock(ThingToMock)
+                mock.bar.expect()
+                mock.baz.expect().infinite_times()
+                mock.bar()
+            def test_unmet(self):
+                mock = Mock(ThingToMock)
+                self.assertTrue(mock._context is self.ditto_context)
+                mock.bar.expect()
+                mock.baz.expect().times(2)
+
+        testing.leaks.clear()
+        unscoped = default_context.expectations
+
+        result = unittest.TestResult()
+        unittest.defaultTestLoader.loadTestsFromTestCase(Tests)(result)
+        self.assertEquals(2, result.testsRun)
+        self.assertEquals(1, len(result.errors) + len(result.failures))
+        self.assertEquals([Tests('test_unmet').id()],
+                          list(testing.leaks.tests))
+        self.assertEquals(2, testing.leaks.total)
+
+        @testing.verify_expectations
+        def unmet():
+            Mock(ThingToMock).bar.expect()
+        self.assertRaises(UnmetExpectations, unmet)
+        self.assertEquals(3, testing.leaks.total)
+
+        self.assertEquals(unscoped, default_context.expectations)
+        testing.leaks.clear()
+
+
+class Benchmarks(unittest.TestCase):
+
+    def runTest(self):
+        self.assertTrue(bench.call_with_expectations(10, count=10) > 0)
+        self.assertTrue(bench.sequence_10000(length=10) > 0)
+
+        # The cached method plan is what makes mocking a class again cheap.
+        self.assertTrue(bench.construct_large(count=200) <
+                        bench.construct_large_cold(count=20))
+
+        old = {'a': {'value': 1.0, 'unit': 's'},
+               'b': {'value': 2.0, 'unit': 's'}}
+        new = {'a': {'value': 1.05, 'unit': 's'},
+               'b': {'value': 3.0, 'unit': 's'},
+               'c': {'value': 1.0, 'unit': 's'}}
+        self.assertEquals([('a', 1.0, 1.05, 1.05, False),
+                           ('b', 2.0, 3.0, 1.5, True)],
+                          sorted(bench.compare(old, new, threshold=0.1)))
+
+
+class DispatchStatistics(unittest.TestCase):
+
+    def runTest(self):
+        context = Context()
+        mock = Mock(ThingToMock, _context=context)
+        plain_matches = Expectation._matches
+
+        stats = context.enable_stats()
+        self.assertTrue(context.enable_stats() is stats)
+        self.assertFalse(Expectation._matches == plain_matches)
+
+        mock.bar.expect(1).times(2)
+        mock.bar.expect(matches(hamcrest.greater_than(1)))
+        mock.baz.expect().infinite_times()
+
+        mock.bar(1)
+        mock.bar(1)
+        mock.bar(5)
+        self.assertRaises(UnexpectedMethodCall, mock.bar, 5)
+        for x in range(3):
+            mock.baz()
+
+        bar = stats.methods[mock.bar]
+        self.assertEquals(4, bar.calls)
+        self.assertEquals(1, bar.unexpected)
+        self.assertEquals(2, bar.retired)
+        # bar(1) is found through the index, and the second bar(5) finds
+        # nothing left to scan, so only the first bar(5) scans the matcher.
+        self.assertEquals(1, bar.scanned)
+        self.assertEquals(1, bar.matcher_calls)
+        self.assertEquals(3, stats.methods[mock.baz].calls)
+        self.assertEquals(0, stats.methods[mock.baz].retired)
+        self.assertEquals(7, stats.total('calls'))
+        self.assertTrue('ThingToMock.bar' in stats.report())
+
+        self.assertTrue(context.disable_stats() is stats)
+        self.assertEquals(None, context.stats)
+        self.assertEquals(Expectation._matches, plain_matches)
+        mock.baz()
+        self.assertEquals(3, stats.methods[mock.baz].calls)
+
+
+class CallJournal(unittest.TestCase):
+
+    def runTest(self):
+        context = Context()
+        mock = Mock(ThingToMock, _context=context)
+        mock.bar.expect(matches(hamcrest.anything())).infinite_times()
+
+        self.assertRaises(ValueError, context.enable_journal, capture='all')
+        journal = context.enable_journal(capacity=5)
+        stats = context.enable_stats()
+
+        for x in range(100):
+            mock.bar(x)
+        self.assertEquals(5, len(journal.entries))
+        self.assertEquals(['95', '96', '97', '98', '99'],
+                          [x.arguments for x in journal.entries])
+        self.assertEquals(['98', '99'],
+                          [x.arguments for x in journal.recent(2)])
+        self.assertEquals(100, stats.methods[mock.bar].calls)
+
+        # Turning stats off leaves the journal on.
+        context.disable_stats()
+        try:
+            mock.baz('missing')
+        except UnexpectedMethodCall as e:
+            self.assertTrue('Recent Calls:' in str(e))
+            self.assertTrue('ThingToMock.bar(99) -> matched' in str(e))
+        self.assertTrue(journal.entries[-1].expectation is None)
+        self.assertTrue('baz(...' not in journal.format())
+
+        self.assertTrue(context.disable_journal() is journal)
+        mock.bar(100)
+        self.assertEquals('99', journal.entries[-2].arguments)
+
+        big = [0] * 1000
+        journal = context.enable_journal(capture='reference')
+        mock.bar(big)
+        self.assertTrue(journal.entries[0].arguments[0][0] is big)
+        context.disable_journal()
+
+        journal = context.enable_journal(capture='none')
+        mock.bar(big)
+        self.assertEquals(None, journal.entries[0].arguments)
+        self.assertTrue('ThingToMock.bar(...)' in journal.format())
+
+
+class CompiledMatchers(unittest.TestCase):
+
+    def runTest(self):
+        class Counting(object):
+            calls = 0
+            def matches(self, item):
+                Counting.calls += 1
+                return True
+
+        context = Context()
+        mock = Mock(ThingToMock, _context=context)
+        mock.bar.expect(matches(Counting()), 1, key=matches(Counting()))
+
+        # Literals, the arity and the keywords are all checked before any
+        # matcher runs.
+        for args, kwargs in [(('x', 2), {'key': 1}), (('x', 1), {}),
+                             (('x', 1, 2), {'key': 1}),
+                             (('x', 1), {'other': 1})]:
+            self.assertRaises(UnexpectedMethodCall, mock.bar, *args, **kwargs)
+        self.assertEquals(0, Counting.calls)
+
+        mock.bar('x', 1, key=3)
+        self.assertEquals(2, Counting.calls)
+        context.assert_no_more_expectations()
+
+        # Even when the matcher is last anyway, so no code is generated.
+        mock.bar.expect(1, matches(Counting())).optional()
+        self.assertRaises(UnexpectedMethodCall, mock.bar, 1, 'x', other=5)
+        self.assertEqual(2, Counting.calls)
+
+
+class NativeMatchers(unittest.TestCase):
+
+    def runTest(self):
+        context = Context()
+        mock = Mock(ThingToMock, _context=context)
+        mock.bar.expect(matches(matchers.instance_of((int, float))),
+                        matches(matchers.contains_string('foo')),
+                        matches(matchers.anything()),
+                        key=matches(matchers.equal_to(3)))
+        mock.baz.expect(matches(matchers.predicate(lambda x: x % 2, 'odd')))
+
+        self.assertRaises(UnexpectedMethodCall, mock.bar, 'x', 'food', None,
+                          key=3)
+        self.assertRaises(UnexpectedMethodCall, mock.bar, 1, 'fod', None,
+                          key=3)
+        self.assertRaises(UnexpectedMethodCall, mock.bar, 1, 2, None, key=3)
+        self.assertRaises(UnexpectedMethodCall, mock.bar, 1.5, 'food', None,
+                          key=4)
+        self.assertRaises(UnexpectedMethodCall, mock.baz, 2)
+        mock.bar(1.5, 'food', object(), key=3)
+        mock.baz(3)
+        context.assert_no_more_expectations()
+
+        self.assertEquals('an instance of int or float',
+                          str(matchers.instance_of((int, float))))
+        self.assertEquals("a string containing 'foo'",
+                          str(matchers.contains_string('foo')))
+        self.assertEquals('odd', str(matchers.predicate(bool, 'odd')))
+        self.assertEquals('<ANYTHING>', repr(matches(matchers.anything())))
+
+
+class ParentContexts(unittest.TestCase):
+
+    def runTest(self):
+        stubs = Context()
+        shared = Mock(ThingToMock, _context=stubs)
+        shared.bar.expect(1).returns('stub').infinite_times()
+        shared.baz.expect().infinite_times()
+        self.assertRaises(MockError, Context, parent=stubs)
+
+        self.assertTrue(stubs.freeze() is stubs)
+        self.assertRaises(MockError, shared.bar.expect, 2)
+        self.assertRaises(MockError, stubs.retire_all_expectations)
+
+        with use_context(Context(parent=stubs)) as child:
+            shared.bar.expect(1).returns('override')
+            self.assertEquals('override', shared.bar(1))
+            self.assertEquals('stub', shared.bar(1))
+            shared.baz()
+
+            shared.bar.expect(5)
+            self.assertRaises(UnmetExpectations,
+                              child.assert_no_more_expectations)
+            shared.bar(5)
+            child.assert_no_more_expectations()
+            self.assertRaises(UnexpectedMethodCall, shared.bar, 6)
+
+            grandchild = ThreadSafeContext(child.freeze())
+            with use_context(grandchild):
+                self.assertEquals('stub', shared.bar(1))
+
+        self.assertEquals('stub', shared.bar(1))
+        self.assertEquals(2, len(stubs.expectations))
+
+        context = Context()
+        Mock(ThingToMock, _context=context).bar.expect()
+        self.assertRaises(MockError, context.freeze)
+
+
+class Snapshots(unittest.TestCase):
+
+    def runTest(self):
+        for context in (Context(), ThreadSafeContext()):
+            self.check(context)
+
+    def check(self, context):
+        mock = Mock(ThingToMock, _context=context)
+        mock.bar.expect(1).times(2)
+        mock.bar.expect(matches(hamcrest.anything())).returns('any')
+        mock.baz.expect(2).until_sums_to(4)
+        s = Sequence()
+        mock.baz.expect('first').in_sequence(s)
+        mock.bar.expect('second').in_sequence(s)
+
+        before = context.active_expectations()
+        snapshot = context.snapshot()
+
+        for x in range(2):
+            mock.bar(1)
+            mock.bar(1)
+            mock.baz(2)
+            mock.baz(2)
+            mock.baz('first')
+            mock.bar('second')
+            self.assertEquals('any', mock.bar(1))
+            mock.baz.expect('extra').in_sequence(Sequence())
+            mock.bar.expect(3)
+            mock.bar.expect(4).in_sequence(s)
+            self.assertRaises(UnexpectedMethodCall, mock.baz, 2)
+            later = context.snapshot()
+
+            context.restore(snapshot)
+            self.assertEquals(before, context.active_expectations())
+            self.assertEquals((s,), context.sequences)
+            self.assertEquals(2, len(s.expectations))
+            self.assertRaises(MockError, context.restore, later)
+
+        mock.bar(1)
+        context.retire_all_expectations()
+        context.restore(snapshot)
+        self.assertEquals(before, context.active_expectations())
+        self.assertRaises(MockError, Context().restore, snapshot)
+
+
+class Prototypes(unittest.TestCase):
+
+    def runTest(self):
+        prototype = Prototype(ThingToMock)
+        prototype.mock.bar.expect(1).returns('one').times(2)
+        prototype.mock.bar.expect(matches(hamcrest.anything()))
+        s = Sequence()
+        prototype.mock.baz.expect('first').in_sequence(s)
+        prototype.mock.bar.expect('second').in_sequence(s)
+        prototype.mock.baz.expect(2).until_sums_to(4)
+        self.assertRaises(MockError, prototype.mock.bar, 1)
+
+        context = Context()
+        clones = [prototype.clone(context, name=n) for n in range(2)]
+        self.assertRaises(MockError, prototype.mock.baz.expect)
+        self.assertRaises(MockError, prototype.mock.baz.expect_many,
+                          [((), None)])
+        self.assertEquals(8, len(context.active_expectations()))
+        self.assertEquals(1, clones[1].name)
+
+        for clone in clones:
+            self.assertEquals('one', clone.bar(1))
+            self.assertEquals('one', clone.bar(1))
+            self.assertEquals(None, clone.bar(1))
+            self.assertRaises(UnexpectedMethodCall, clone.bar, 'second')
+            clone.baz('first')
+            clone.bar('second')
+            clone.baz(2)
+            clone.baz(2)
+        context.assert_no_more_expectations()
+
+        with use_context() as scoped:
+            prototype.clone().bar(1)
+            self.assertEquals(4, len(scoped.active_expectations()))
+
+
+class BulkExpectations(unittest.TestCase):
+
+    def runTest(self):
+        context = Context()
+        mock = Mock(ThingToMock, _context=context)
+        mock.bar.expect(0).returns('first')
+        expectations = mock.bar.expect_many([
+            ([0], None),
+            ((1,), {'x': 2}, 'one'),
+            ((matches(hamcrest.greater_than(5)),), {}, 'big', 2),
+            ((3,), None, 'three', Expectation.infinite),
+        ])
+        self.assertEquals(4, len(expectations))
+        self.assertEquals(expectations, list(context.expectations[1:]))
+
+        snapshot = context.snapshot()
+        self.assertEquals('first', mock.bar(0))
+        self.assertEquals(None, mock.bar(0))
+        self.assertEquals('one', mock.bar(1, x=2))
+        self.assertEquals('big', mock.bar(6))
+        self.assertEquals('big', mock.bar(7))
+        self.assertEquals('three', mock.bar(3))
+        context.assert_no_more_expectations()
+
+        mock.baz.expect_many([((), None)] * 3)
+        context.restore(snapshot)
+        self.assertEquals(5, len(context.expectations))
+
+
+class StreamingSequences(unittest.TestCase):
+
+    def runTest(self):
+        context = Context()
+        mock = Mock(ThingToMock, _context=context)
+        read = []
+
+        def transcript():
+            for n in range(1000):
+                read.append(n)
+                yield (mock.bar, [n], None, n * 2)
+                yield Expectation(context, mock.baz, (), {})
+
+        s = StreamingSequence(transcript(), window=3)
+        self.assertEquals((s,), context.sequences)
+        self.assertEquals(3, len(s.expectations))
+        self.assertRaises(MockError,
+                          Expectation(context, mock.bar, (), {}).in_sequence,
+                          s)
+
+        for n in range(1000):
+            self.assertRaises(UnexpectedMethodCall, mock.baz)
+            self.assertEquals(n * 2, mock.bar(n))
+            mock.baz()
+            self.assertTrue(len(s.expectations) <= 3)
+            self.assertTrue(len(read) <= n + 3)
+
+        self.assertEquals((), context.sequences)
+        context.assert_no_more_expectations()
+
+        # Steps that were declared with expect() only count in order.
+        for context in (Context(), ThreadSafeContext()):
+            mock = Mock(ThingToMock, _context=context)
+            StreamingSequence((mock.bar.expect(n) for n in range(5)),
+                              window=2)
+            mock.bar(0)
+            self.assertEquals(0, len(context.expectations))
+            self.assertRaises(UnexpectedMethodCall, mock.bar, 2)
+            for n in range(1, 5):
+                mock.bar(n)
+            self.assertRaises(UnexpectedMethodCall, mock.bar, 2)
+            context.assert_no_more_expectations()
+
+        # A step that can't be read ends the sequence instead of leaving the
+        # context with an empty one.
+        def broken():
+            yield (mock.bar, (0,))
+            yield (mock.bar, (1,))
+            raise MockTestExcpetion
+
+        for context in (Context(), ThreadSafeContext()):
+            mock = Mock(ThingToMock, _context=context)
+            StreamingSequence(broken(), window=1)
+            mock.bar(0)
+            self.assertRaises(MockTestExcpetion, mock.bar, 1)
+            self.assertEqual((), context.sequences)
+            self.assertRaises(UnexpectedMethodCall, mock.bar, 2)
+            context.assert_no_more_expectations()
+
+        # Every step has to be in the same context.
+        context, other_context = Context(), Context()
+        mock = Mock(ThingToMock, _context=context)
+        other_mock = Mock(ThingToMock, _context=other_context)
+        steps = [(mock.bar, (1,)), (other_mock.bar, (2,))]
+        self.assertRaises(MockError, StreamingSequence, steps)
+        self.assertEqual((), context.sequences)
+
+        StreamingSequence(steps, window=1)
+        self.assertRaises(MockError, mock.bar, 1)
+        self.assertEqual((), context.sequences)
+        context.assert_no_more_expectations()
+        other_context.assert_no_more_expectations()
+
+
+def load_tests(loader, tests, pattern):
+    # test_aio needs python 3.5. Discovery finds it on its own; this is for
+    # ``setup.py test``, and anything else that loads just this module.
+    if pattern is None and sys.version_info >= (3, 5):
+        from ditto import test_aio
+        tests.addTests(loader.loadTestsFromModule(test_aio))
+    return tests
+
+
 if __name__ == '__main__':
     unittest.main()    
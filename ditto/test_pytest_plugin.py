@@ -0,0 +1,89 @@
+# Copyright (C) 2010-2011 Cisco Systems, Inc
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# (1) Redistributions of source code must retain the above copyright notice,
+#     this list of conditions and the following disclaimer.
+#
+# (2) Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions and the following disclaimer in the documentation
+#     and/or other materials provided with the distribution.  
+#
+# THIS SOFTWARE IS PROVIDED BY CISCO SYSTEMS ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL CISCO SYSTEMS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are
+# those of the authors and should not be interpreted as representing official
+# policies, either expressed or implied, of Cisco Systems, Inc.
+
+
+# Tests for ``ditto.pytest_plugin``. They're pytest tests, not unittest ones,
+# since they run pytest itself on a small suite through its pytester plugin.
+
+import unittest
+
+try:
+    import pytest
+except ImportError:
+    raise unittest.SkipTest('needs pytest')
+
+# The pytester fixture.
+pytest.importorskip('pytest', minversion='6.2')
+
+from ditto.testing import leaks
+
+
+pytest_plugins = ['pytester']
+
+
+SUITE = '''
+from ditto import Mock, current_context
+
+class Thing(object):
+    def bar(self):
+        pass
+
+def test_met(ditto_context):
+    thing = Mock(Thing)
+    assert thing._context is ditto_context
+    assert current_context() is ditto_context
+    thing.bar.expect()
+    thing.bar()
+
+def test_unmet(ditto_context):
+    Mock(Thing).bar.expect().times(2)
+'''
+
+
+def test_plugin(pytester):
+    pytester.makepyfile(test_suite=SUITE)
+
+    # The run happens in this process, and shares the tally of leaks with
+    # whatever pytest session is running these tests.
+    saved = leaks.tests.copy()
+    try:
+        # The plugin is loaded explicitly, whether or not ditto is installed.
+        result = pytester.runpytest('-p', 'no:ditto',
+                                    '-p', 'ditto.pytest_plugin')
+    finally:
+        leaks.clear()
+        leaks.tests.update(saved)
+
+    result.assert_outcomes(passed=2, errors=1)
+    result.stdout.fnmatch_lines([
+        '*ERROR at teardown of test_unmet*',
+        '*UnmetExpectations*',
+        '*= ditto =*',
+        'test_suite.py::test_unmet: 1 unmet',
+        '1 test left 1 expectation unmet',
+    ])
+    assert 'test_met' not in result.stdout.str().split('= ditto =')[1]
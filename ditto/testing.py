@@ -0,0 +1,133 @@
+# Copyright (C) 2010-2011 Cisco Systems, Inc
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# (1) Redistributions of source code must retain the above copyright notice,
+#     this list of conditions and the following disclaimer.
+#
+# (2) Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions and the following disclaimer in the documentation
+#     and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY CISCO SYSTEMS ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL CISCO SYSTEMS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are
+# those of the authors and should not be interpreted as representing official
+# policies, either expressed or implied, of Cisco Systems, Inc.
+
+"""\
+Per-test contexts for ``unittest``.
+
+Rather than retiring ``default_context`` in every ``setUp`` and remembering to
+call ``assert_no_more_expectations()`` at the end of every test, mix
+``ContextMixin`` into your test case::
+
+    class FooTest(ContextMixin, unittest.TestCase):
+
+        def test_foo(self):
+            foo = Mock(Foo)      # in self.ditto_context
+            foo.bar.expect()
+            ...                  # fails if foo.bar() wasn't called
+
+or decorate individual test functions with ``verify_expectations``. Either way,
+each test runs in a fresh ``Context`` (see ``use_context``), which is checked
+for unmet expectations once the test is over and then thrown away, so nothing
+a test expects can pile up and slow down the tests after it.
+
+Tests that failed verification are tallied in ``leaks``. The pytest plugin
+(``ditto.pytest_plugin``) offers the same thing as the ``ditto_context``
+fixture.
+"""
+
+import collections
+import functools
+
+from ditto import UnmetExpectations, is_coroutine_function, use_context
+
+
+class LeakTally(object):
+
+    """Counts the expectations that tests left unmet.
+
+    :Attributes:
+        - `tests`: An ordered mapping of test name to the number of required
+          expectations it left unmet.
+    """
+
+    def __init__(self):
+        self.tests = collections.OrderedDict()
+
+    @property
+    def total(self):
+        return sum(self.tests.values())
+
+    def record(self, test_name, count):
+        self.tests[test_name] = self.tests.get(test_name, 0) + count
+
+    def clear(self):
+        self.tests.clear()
+
+    def summary(self):
+        return '%d test%s left %d expectation%s unmet' % (
+            len(self.tests), '' if len(self.tests) == 1 else 's',
+            self.total, '' if self.total == 1 else 's',
+        )
+
+
+leaks = LeakTally()
+
+
+def verify(context, test_name):
+    """Assert that `context` has no more required expectations, counting any
+    that are left against `test_name` in ``leaks``.
+    """
+    try:
+        context.assert_no_more_expectations()
+    except UnmetExpectations as e:
+        leaks.record(test_name, len(e.required))
+        raise
+
+
+def verify_expectations(func):
+    """Decorate a test function so that it runs in a fresh context, which has
+    to have no required expectations left when the function returns. A
+    coroutine function is checked once its coroutine is done.
+    """
+    if is_coroutine_function(func):
+        from ditto.aio import _verified
+        return _verified(func)
+
+    @functools.wraps(func)
+    def test(*args, **kwargs):
+        with use_context() as context:
+            result = func(*args, **kwargs)
+            verify(context, getattr(func, '__name__', repr(func)))
+
+        return result
+
+    return test
+
+
+class ContextMixin(object):
+
+    """Runs each test of a ``unittest.TestCase`` in a fresh context, available
+    as `ditto_context`, and verifies it once ``tearDown`` and any other
+    cleanups are done.
+    """
+
+    def run(self, result=None):
+        with use_context() as context:
+            self.ditto_context = context
+            self.addCleanup(verify, context, self.id())
+
+            return super(ContextMixin, self).run(result)
@@ -7,6 +7,8 @@ setup(name='ditto',
       author_email='kyle.derr@gmail.com',
       url='https://github.com/ironport/ditto',
       packages=find_packages(),
-      install_requires=['PyHamcrest'],
+      extras_require={'hamcrest': ['PyHamcrest']},
+      tests_require=['PyHamcrest'],
       test_suite='ditto.test_ditto',
+      entry_points={'pytest11': ['ditto = ditto.pytest_plugin']},
 )